@@ -0,0 +1,23 @@
+"""Tool plugin for the benchmark: an instant, deterministic echo"""
+
+
+async def echo(text: str) -> list:
+    return [("echo", text)]
+
+
+TOOLS = {
+    "bench_echo": {
+        "type": "function",
+        "function": {
+            "description": "Echo the given text back.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string", "description": "Text to echo."},
+                },
+                "required": ["text"],
+            },
+        },
+        "callable": echo,
+    },
+}
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for cogs.chunker.split_message on large model replies.
+
+    python bench/chunker_bench.py [size_kb ...]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.chunker import split_message
+
+
+def make_reply(size: int, seed: int = 0) -> str:
+    """A markdown reply of about size characters mixing prose, lists, tables and code"""
+    rng = random.Random(seed)
+    words = ["the", "model", "token", "reply", "discord", "supercalifragilistic", "42", "`x`"]
+    parts = []
+    total = 0
+    while total < size:
+        kind = rng.randrange(4)
+        if kind == 0:
+            block = " ".join(rng.choice(words) for _ in range(rng.randint(20, 200)))
+        elif kind == 1:
+            block = "\n".join(f"- {' '.join(rng.choice(words) for _ in range(8))}" for _ in range(6))
+        elif kind == 2:
+            block = "| a | b |\n|---|---|\n" + "\n".join(f"| {n} | {n * n} |" for n in range(12))
+        else:
+            block = "```python\n" + "\n".join(f"value_{n} = compute({n})" for n in range(40)) + "\n```"
+        parts.append(block)
+        total += len(block) + 2
+    return "\n\n".join(parts)
+
+
+def main(sizes):
+    for size_kb in sizes:
+        text = make_reply(size_kb * 1024)
+        runs, elapsed = timeit.Timer(lambda: split_message(text)).autorange()
+        per_call = elapsed / runs
+        chunks = len(split_message(text))
+        print(f"{size_kb:>5} KB: {per_call * 1000:8.3f} ms/call, {len(text) / per_call / 1e6:6.1f} MB/s, {chunks} chunks")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000])
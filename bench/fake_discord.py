@@ -0,0 +1,137 @@
+"""Just enough of discord.py's Message/Context/Bot surface to drive ChatCog offline.
+
+Every call that would hit discord's REST API is counted in FakeBot.rest_calls."""
+
+import asyncio
+import copy
+import itertools
+from collections import Counter
+
+_ids = itertools.count(10**17)
+
+
+class FakeUser:
+    def __init__(self, name: str, bot: bool = False):
+        self.id = next(_ids)
+        self.name = name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+
+class FakeReference:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+        # never pre-resolved, so ChatCog goes through its own lookup path
+        self.resolved = None
+
+
+class FakeChannel:
+    def __init__(self, bot):
+        self.id = next(_ids)
+        self.bot = bot
+        self.messages = {}
+
+    def add(self, message):
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int):
+        await self.bot.rest("fetch_message")
+        return self.messages[message_id]
+
+    async def send(self, content=None, **kwargs):
+        await self.bot.rest("send")
+        return self.add(FakeMessage(self, self.bot.user, content, **kwargs))
+
+
+class FakeAttachment:
+    """A file sent with discord.File, read back through the CDN"""
+
+    def __init__(self, bot, file):
+        self.bot = bot
+        self.filename = file.filename
+        self._data = file.fp.read()
+
+    async def read(self) -> bytes:
+        await self.bot.rest("attachment_read")
+        return self._data
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, reference=None, mentions=(), embed=None, **_):
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content or ""
+        self.embeds = [embed] if embed is not None else []
+        self.attachments = []
+        self.reference = FakeReference(reference.id) if reference is not None else None
+        self.mentions = list(mentions)
+        self.guild = None
+        self.deleted = False
+
+    async def reply(self, content=None, **kwargs):
+        await self.channel.bot.rest("reply")
+        return self.channel.add(FakeMessage(self.channel, self.channel.bot.user, content, reference=self, **kwargs))
+
+    async def edit(self, content=..., embed=..., attachments=..., **_):
+        """Like discord.py, leaves this object as it was and returns the edited message"""
+        await self.channel.bot.rest("edit")
+        edited = copy.copy(self)
+        if content is not ...:
+            edited.content = content or ""
+        if embed is not ...:
+            edited.embeds = [embed] if embed is not None else []
+        if attachments is not ...:
+            edited.attachments = [FakeAttachment(self.channel.bot, file) for file in attachments]
+        return self.channel.add(edited)
+
+    async def delete(self):
+        await self.channel.bot.rest("delete")
+        self.deleted = True
+
+
+class FakeContext:
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.guild = None
+
+    async def reply(self, content=None, **kwargs):
+        return await self.message.reply(content, **kwargs)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeBot:
+    """Stands in for commands.Bot. rest_latency simulates discord's API round trip"""
+
+    def __init__(self, rest_latency: float = 0.0):
+        self.user = FakeUser("bench-bot", bot=True)
+        self.cached_messages = []
+        self.rest_latency = rest_latency
+        self.rest_calls = Counter()
+
+    async def rest(self, kind: str):
+        self.rest_calls[kind] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+
+    async def get_context(self, message):
+        return FakeContext(self, message)
+
+    def thread(self, depth: int, user: FakeUser, text: str = "tell me more"):
+        """A channel holding a reply chain of depth alternating user/bot messages,
+        plus a final user message that replies to it and mentions the bot"""
+        channel = FakeChannel(self)
+        previous = None
+        for turn in range(depth):
+            author = user if turn % 2 == 0 else self.user
+            previous = channel.add(FakeMessage(channel, author, f"turn {turn}: {text}", reference=previous))
+        trigger = channel.add(FakeMessage(channel, user, text, reference=previous, mentions=[self.user]))
+        return channel, trigger
@@ -0,0 +1,116 @@
+"""A stub OpenAI-compatible server for offline benchmarks.
+
+Answers /v1/models and /v1/chat/completions (streamed or not) after a fixed
+first-token latency, emitting reply_tokens tokens at token_rate tokens/s.
+When tools are offered, a tool_call_rate share of first rounds ask for the
+bench_echo tool instead of answering."""
+
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+MODEL = "bench-model"
+
+
+class MockLLM:
+    def __init__(self, latency: float = 0.05, token_rate: float = 200, reply_tokens: int = 150,
+                 tool_call_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.tool_call_rate = tool_call_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.tool_call_rounds = 0
+        self._runner = None
+        self.url = None
+
+    def _wants_tool(self, body: dict) -> bool:
+        messages = body.get("messages", [])
+        if not body.get("tools") or body.get("tool_choice") == "none":
+            return False
+        if messages and messages[-1].get("role") == "tool":
+            return False
+        return self.rng.random() < self.tool_call_rate
+
+    def _tokens(self) -> list:
+        return [f"tok{n} " for n in range(self.reply_tokens)]
+
+    @staticmethod
+    def _tool_call(index: int = 0) -> dict:
+        return {
+            "index": index,
+            "id": f"call_{time.monotonic_ns()}",
+            "type": "function",
+            "function": {"name": "bench_echo", "arguments": json.dumps({"text": "ping"})},
+        }
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": MODEL, "object": "model"}]})
+
+    async def chat(self, request):
+        body = await request.json()
+        self.requests += 1
+        tool = self._wants_tool(body)
+        if tool:
+            self.tool_call_rounds += 1
+        await asyncio.sleep(self.latency)
+        if body.get("stream"):
+            return await self._stream(request, tool)
+
+        if tool:
+            message = {"role": "assistant", "content": None, "tool_calls": [self._tool_call()]}
+            finish_reason = "tool_calls"
+        else:
+            await asyncio.sleep(self.reply_tokens / self.token_rate)
+            message = {"role": "assistant", "content": "".join(self._tokens())}
+            finish_reason = "stop"
+        return web.json_response({
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        })
+
+    async def _stream(self, request, tool: bool):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def event(delta: dict, finish_reason=None):
+            chunk = {"object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        if tool:
+            await event({"role": "assistant", "tool_calls": [self._tool_call()]})
+            await event({}, "tool_calls")
+        else:
+            # pace tokens in small batches instead of one sleep per token
+            batch = max(1, int(self.token_rate * 0.02))
+            tokens = self._tokens()
+            for start in range(0, len(tokens), batch):
+                await event({"content": "".join(tokens[start:start + batch])})
+                await asyncio.sleep(len(tokens[start:start + batch]) / self.token_rate)
+            await event({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        # port 0 picks a free port; read back which one
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
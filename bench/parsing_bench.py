@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of cogs.parsing against the per-call parsing it replaced.
+
+    python bench/parsing_bench.py
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs import parsing
+
+
+def legacy_extract_model(message, default):
+    match = re.search(r'/([^/]+)/', message)
+    if match:
+        return match.group(1), (message[:match.start()] + message[match.end():]).strip()
+    return default, message
+
+
+def legacy_strip_reasoning(ai_response):
+    for tag in ["</thinking>", "</reasoning>", "</think>"]:
+        if tag in ai_response:
+            return ai_response.split(tag)[-1]
+    return ai_response
+
+
+def bench(label, fn, *args):
+    runs, elapsed = timeit.Timer(lambda: fn(*args)).autorange()
+    print(f"{label:<40} {elapsed / runs * 1e6:10.2f} us/call")
+
+
+def main():
+    message = "!chat /qwen3-32b/ what does this stack trace mean? " + "frame " * 40
+    answer = "<think>" + "let me reason about this. " * 400 + "</think>" + "The answer is 42. " * 200
+    plain = "The answer is 42. " * 600
+
+    bench("extract_model (legacy)", legacy_extract_model, message, "default")
+    bench("extract_model", parsing.extract_model, message, "default")
+    bench("strip_reasoning, with reasoning (legacy)", legacy_strip_reasoning, answer)
+    bench("strip_reasoning, with reasoning", parsing.strip_reasoning, answer)
+    bench("strip_reasoning, no reasoning (legacy)", legacy_strip_reasoning, plain)
+    bench("strip_reasoning, no reasoning", parsing.strip_reasoning, plain)
+    bench("prompt_text", parsing.prompt_text, message, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""End to end throughput benchmark of ChatCog, fully offline.
+
+Runs ChatCog against bench/mock_llm.py with fake discord objects
+(bench/fake_discord.py) for every combination of concurrency and thread
+depth, then prints a table and saves the results as JSON for comparison
+between commits.
+
+    python bench/run_bench.py --concurrency 1 4 16 --depth 0 4 16 --messages 50
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_discord import FakeBot, FakeContext, FakeUser
+from bench.mock_llm import MODEL, MockLLM
+from cogs.chat_cog import ChatCog
+from cogs.metrics import METRICS
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def bench_env(base: dict, url: str, concurrency: int, args) -> dict:
+    """The repo's model_env pointed at the mock server, with the bench tool only"""
+    env = dict(base)
+    env.update({
+        "llm_url": url,
+        "backends": [{"url": url, "models": [MODEL]}],
+        "routing": {**base.get("routing", {}), "probe_interval": 3600},
+        "default_model": MODEL,
+        "stream": args.stream,
+        "stream_edit_interval": args.edit_interval,
+        "scheduler": {"max_concurrent": concurrency, "per_user": 1, "per_channel": concurrency},
+        "conversation_store": {"backend": "memory"},
+        "tool_registry": {"plugins": ["bench.bench_tools"], "models": {MODEL: ["bench_echo"]}, "channels": {}},
+        "tool_cache": {},
+        "tools": {},
+        "metrics": {"exporter": {"enabled": False}},
+    })
+    return env
+
+
+async def run_case(base_env: dict, mock: MockLLM, concurrency: int, depth: int, args) -> dict:
+    with open("model_env", "w") as f:
+        json.dump(bench_env(base_env, mock.url, concurrency, args), f)
+
+    bot = FakeBot(args.rest_latency)
+    cog = ChatCog(bot)
+    await cog.cog_load()
+    threads = [bot.thread(depth, FakeUser(f"user{n}")) for n in range(args.messages)]
+    if not args.cold_cache:
+        # the gateway delivered the history, so it is in the message cache already
+        for channel, _ in threads:
+            for message in channel.messages.values():
+                cog.message_cache.put(message)
+    bot.rest_calls.clear()
+    METRICS.reset()
+    requests_before = mock.requests
+
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(trigger):
+        async with gate:
+            started = time.perf_counter()
+            if depth:
+                await cog.on_message(trigger)
+            else:
+                await cog.chat.callback(cog, FakeContext(bot, trigger), message=trigger.content)
+            latencies.append(time.perf_counter() - started)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(trigger) for _, trigger in threads))
+    wall = time.perf_counter() - started
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    await cog.cog_unload()
+
+    rest_total = sum(bot.rest_calls.values())
+    return {
+        "concurrency": concurrency,
+        "depth": depth,
+        "messages": args.messages,
+        "wall_s": wall,
+        "msgs_per_s": args.messages / wall,
+        "latency_s": {f"p{q}": percentile(latencies, q / 100) for q in (50, 95, 99)},
+        "rest_calls_per_msg": rest_total / args.messages,
+        "rest_calls": dict(bot.rest_calls),
+        "llm_requests_per_msg": (mock.requests - requests_before) / args.messages,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "tracemalloc_peak_bytes": traced_peak,
+        "stages": METRICS.snapshot(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main(args):
+    with open(os.path.join(ROOT, "model_env")) as f:
+        base_env = json.load(f)
+
+    mock = MockLLM(args.latency, args.token_rate, args.reply_tokens, args.tool_call_rate, args.seed)
+    await mock.start()
+    cases = []
+    # ChatCog reads ./model_env, so each case writes its own into a scratch directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            for concurrency in args.concurrency:
+                for depth in args.depth:
+                    case = await run_case(base_env, mock, concurrency, depth, args)
+                    cases.append(case)
+                    print(f"concurrency {concurrency:>3} depth {depth:>3}: "
+                          f"{case['msgs_per_s']:7.2f} msg/s, "
+                          f"p50 {case['latency_s']['p50'] * 1000:7.1f}ms "
+                          f"p95 {case['latency_s']['p95'] * 1000:7.1f}ms "
+                          f"p99 {case['latency_s']['p99'] * 1000:7.1f}ms, "
+                          f"{case['rest_calls_per_msg']:.2f} REST calls/msg")
+        finally:
+            os.chdir(cwd)
+            await mock.stop()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "cases": cases,
+    }
+    out = args.out or os.path.join(
+        ROOT, "bench", "results", f"bench-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {out}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--depth", type=int, nargs="+", default=[0, 4, 16],
+                        help="reply chain length before the triggering message (0 uses !chat)")
+    parser.add_argument("--messages", type=int, default=50, help="messages per case")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock LLM time to first token, seconds")
+    parser.add_argument("--token-rate", type=float, default=200, help="mock LLM tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=150)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0,
+                        help="share of first rounds that call the bench_echo tool")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--edit-interval", type=float, default=0.2, help="stream_edit_interval for the cog")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="simulated discord REST round trip, seconds")
+    parser.add_argument("--cold-cache", action="store_true", help="start with an empty message cache")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace the Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file, default bench/results/bench-<time>.json")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
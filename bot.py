@@ -1,24 +1,20 @@
 import discord
 from discord.ext import commands
+import json
 import logging
 import os
 from dotenv import load_dotenv
 import asyncio
 from cogs.hello_cog import HelloCog
 from cogs.chat_cog import ChatCog
+from cogs.log_setup import Truncated, setup_logging
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('discord_bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: handlers run on a background thread, the file gets JSON lines
+with open("model_env") as f:
+    log_listener = setup_logging(json.load(f).get('logging', {}))
 logger = logging.getLogger(__name__)
 
 # Setup bot intents
@@ -57,27 +53,25 @@ async def on_message(message):
         return
 
     # Log all messages for debugging
-    logger.info(f'Received message from {message.author} in {message.guild.name if message.guild else "DM"}: {message.content}')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Received message from %s in %s: %s',
+                     message.author, message.guild.name if message.guild else "DM", Truncated(message.content))
 
     # Pass messages to command processing
     await bot.process_commands(message)
 
-def add_cog(bot, cog):
-    try:
-        bot.add_cog(cog).send(None)
-    except StopIteration as e:
-        logger.info(f'Successfully loaded {cog.__class__.__name__}')
-        logger.info(f'Commands in {cog.__class__.__name__}: {[command.name for command in cog.get_commands()]}')
-    
-def main():
-    # Load the hello cog
-    try:
-        logger.info('adding Hello Cog...')
-        add_cog(bot, HelloCog(bot))
-        logger.info('adding Chat Cog...')
-        add_cog(bot, ChatCog(bot))
-    except ImportError:
-        logger.error('Failed to load HelloCog - file not found')
+async def add_cog(bot, cog):
+    await bot.add_cog(cog)
+    logger.info(f'Successfully loaded {cog.__class__.__name__}')
+    logger.info(f'Commands in {cog.__class__.__name__}: {[command.name for command in cog.get_commands()]}')
+
+@bot.event
+async def setup_hook():
+    """Load the cogs once the event loop is running so cog_load can open sessions"""
+    logger.info('adding Hello Cog...')
+    await add_cog(bot, HelloCog(bot))
+    logger.info('adding Chat Cog...')
+    await add_cog(bot, ChatCog(bot))
 
     # Print all commands from bot.commands after cogs are loaded
     print("\n" + "=" * 50)
@@ -87,16 +81,21 @@ def main():
         print(f"  - {command.name}")
     print("=" * 50 + "\n")
 
+def main():
     # Get token from environment variable
     token = os.getenv('DISCORD_TOKEN')
 
-    if token and token != 'your_discord_bot_token_here':
-        logger.info('Starting bot...')
-        bot.run(token)
-    else:
-        logger.error('DISCORD_TOKEN not found or not set correctly in .env file')
-        logger.error(f'DISCORD_TOKEN={token}')
-        print('Please set your Discord bot token in the .env file and run the bot again.')
+    try:
+        if token and token != 'your_discord_bot_token_here':
+            logger.info('Starting bot...')
+            # discord.py logs through our root handlers instead of installing its own
+            bot.run(token, log_handler=None)
+        else:
+            logger.error('DISCORD_TOKEN not found or not set correctly in .env file')
+            logger.error(f'DISCORD_TOKEN={token}')
+            print('Please set your Discord bot token in the .env file and run the bot again.')
+    finally:
+        log_listener.stop()
 
 # Run the main function
 main()
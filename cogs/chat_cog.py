@@ -1,55 +1,168 @@
 import discord
 from discord.ext import commands
+import json
 import logging
-import re
+import traceback
+import time
+import asyncio
 import aiohttp
 from cogs.tools import tool_router
+from cogs import streaming
+from cogs import delivery
+from cogs import parsing
+from cogs.message_cache import MessageCache
+from cogs import conversation_store
+from cogs import context_builder
+from cogs import prompt_layout
+from cogs.scheduler import RequestScheduler, RequestCancelled
+from cogs import llm_router
+from cogs import model_catalogue
+from cogs.metrics import METRICS
+from cogs import metrics
+from cogs.log_setup import log_payload
 
 logger = logging.getLogger(__name__)
 
+# request bodies are pre-encoded so the cached tool schema JSON is reused
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 class ChatCog(commands.Cog):
     """A cog that handles chat interactions with an OpenAI-compatible LLM"""
 
     def __init__(self, bot):
-        import json
         """Initialize the cog with the bot instance"""
         with open("model_env") as f:
             model_env = json.load(f)
             assert "system_prompt" in model_env.keys()
-            assert "llm_url" in model_env.keys()
+            assert "llm_url" in model_env.keys() or "backends" in model_env.keys()
             assert "default_model" in model_env.keys()
 
         self.bot = bot
-        self.llm_url = f"{model_env['llm_url']}/v1"
+        self.router = llm_router.from_config(model_env)
+        # served models and their metadata, refreshed by the router's health probes
+        self.catalogue = model_catalogue.from_config(self.router, model_env.get('model_catalogue', {}))
         self.current_model = model_env['default_model']
         self.system_prompt = model_env['system_prompt']
-        self.tools = tool_router.open_ai_tool_list()
+        tool_router.configure(
+            model_env.get('tools', {}), model_env.get('tool_cache', {}), model_env.get('tool_registry', {}))
+
+        # tool calls of one turn run concurrently, each tool with its own limit
+        tool_exec = model_env.get('tool_execution', {})
+        self.tool_concurrency = tool_exec.get('per_tool_concurrency', 2)
+        self.tool_timeout = tool_exec.get('timeout', 120)
+        self.tool_limits = {}
+
+        # bounds on the tool calling loop of a single request
+        agent_loop = model_env.get('agent_loop', {})
+        self.max_tool_rounds = agent_loop.get('max_rounds', 5)
+        self.total_budget = agent_loop.get('total_budget', 900)
+        self.request_timeout = agent_loop.get('request_timeout', 600)
+
+        # connection pool settings for the shared LLM session
+        http_pool = model_env.get('http_pool', {})
+        self.pool_limit = http_pool.get('limit', 100)
+        self.pool_limit_per_host = http_pool.get('limit_per_host', 8)
+        self.pool_keepalive = http_pool.get('keepalive_timeout', 60)
+        self.pool_dns_ttl = http_pool.get('ttl_dns_cache', 300)
+        self.session = None
+
+        # stream tokens into the placeholder message instead of waiting for the full body
+        self.stream = model_env.get('stream', False)
+        self.stream_edit_interval = model_env.get('stream_edit_interval', 1.0)
+
+        # how answers are packed into messages, embeds or a file attachment
+        self.delivery = delivery.from_config(model_env.get('delivery', {}))
+
+        # messages seen on the gateway or sent by us, so reply chains rarely need REST fetches
+        message_cache = model_env.get('message_cache', {})
+        self.message_cache = MessageCache(
+            max_size=message_cache.get('max_size', 2048),
+            max_age=message_cache.get('max_age', 3600),
+        )
+
+        # built message lists keyed by the bot reply that ended them
+        self.conversations = conversation_store.open_store(model_env.get('conversation_store', {}))
+
+        # keeps payloads inside each model's context window
+        self.context_builder = context_builder.from_config(model_env.get('context', {}), self.catalogue.context_length)
+
+        # keep the start of every prompt identical so backend prefix caches hit
+        layout = model_env.get('prompt_layout', {})
+        self.prompt_layout = layout.get('mode', 'stable')
+        self.cache_prompt = layout.get('cache_prompt', False)
+        self.session_field = layout.get('session_field')
+        self.prefix_tracker = prompt_layout.PrefixTracker(layout.get('prefix_window', 8))
+
+        # bounds concurrent LLM requests, queueing the rest fairly per user
+        sched = model_env.get('scheduler', {})
+        self.scheduler = RequestScheduler(
+            max_concurrent=sched.get('max_concurrent', 2),
+            per_user=sched.get('per_user', 1),
+            per_channel=sched.get('per_channel', 2),
+        )
+
+        # stage timings for !perf and the optional scrape endpoint
+        metrics_config = model_env.get('metrics', {})
+        metrics.configure(metrics_config)
+        self.exporter_config = metrics_config.get('exporter', {})
+        self.exporter = None
         logger.info('ChatCog initialized')
 
-    def extract_model(self, message: str) -> tuple[str, str]:
-        """Extract model name from message if present.
-        Returns tuple of (model_name, remaining_message)"""
-        model_pattern = r'/([^/]+)/'
-        match = re.search(model_pattern, message)
-        if match:
-            model = match.group(1)
-            remaining = message[:match.start()] + message[match.end():]
-            return model, remaining.strip()
-        return self.current_model, message
+    async def cog_load(self):
+        """Open the long lived HTTP session shared by all LLM requests"""
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit_per_host,
+            keepalive_timeout=self.pool_keepalive,
+            ttl_dns_cache=self.pool_dns_ttl,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.router.start(self.session)
+        logger.info(f'LLM session opened (limit={self.pool_limit}, per_host={self.pool_limit_per_host})')
+        if self.exporter_config.get('enabled', False):
+            self.exporter = await METRICS.start_exporter(
+                self.exporter_config.get('host', '127.0.0.1'), self.exporter_config.get('port', 9464))
+
+    async def cog_unload(self):
+        """Close the shared HTTP session"""
+        await self.router.stop()
+        await tool_router.close()
+        if self.exporter is not None:
+            await self.exporter.cleanup()
+            self.exporter = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.conversations.close()
+        logger.info('LLM session closed')
 
     async def handle_reply_chain(self, message):
         current_message = message
         reply_chain = [message]
         
         ctx = await self.bot.get_context(message)
-        thinking_msg = await ctx.send("🤔 Thinking...")
+        model, _ = parsing.extract_model(message.content, self.current_model)
+        problem = self._unknown_model(model)
+        if problem:
+            await ctx.reply(problem)
+            return
+        thinking_msg = await ctx.reply("🤔 Thinking...")
+        self.message_cache.put(thinking_msg)
 
         # Loop while there is a message reference
+        prior = None
+        fetch_started = time.perf_counter()
         while current_message.reference:
             try:
-                # Fetch the full message object being replied to
-                # message.channel.fetch_message is the method to get the full object
-                referenced_message = await current_message.channel.fetch_message(current_message.reference.message_id)
+                referenced_message = await self._resolve_reference(current_message)
+                if referenced_message is None:
+                    logger.error(f"Referenced message {current_message.reference.message_id} was deleted.")
+                    break
+                # a stored conversation already holds this reply and everything before it
+                prior = await self.conversations.get(referenced_message.id)
+                if prior is not None:
+                    logger.info(f"continuing stored conversation at {referenced_message.id}")
+                    break
                 reply_chain.append(referenced_message)
                 # Move to the next message in the chain
                 current_message = referenced_message
@@ -66,19 +179,57 @@ class ChatCog(commands.Cog):
                 logger.error(f"HTTPException while fetching message: {e}")
                 break
 
+        METRICS.observe("reply_chain_fetch", time.perf_counter() - fetch_started)
         reply_chain = reply_chain[::-1]
         assert len(reply_chain) > 0, "reply chain was empty. wtf."
         logger.info(f"reply chain found with len: {len(reply_chain)}")
 
-        payload, _ = self.construct_ctx_from_message_list(reply_chain, self.bot)
-        logger.info(f"payload for replies: {payload}")
-        ai_response = await self.query_model(payload)
+        bot_turns = await self._read_bot_turns(reply_chain)
+        payload, users = self.construct_ctx_from_message_list(reply_chain, self.bot, prior, model, bot_turns)
+        log_payload(logger, "payload for replies", payload)
+        await self._answer(ctx, thinking_msg, payload, message, users)
+
+    async def _resolve_reference(self, message):
+        """Return the message that `message` replies to, or None if it was deleted.
+
+        Checks the resolved reference, our message cache and discord.py's own cache
+        before falling back to a REST fetch."""
+        reference = message.reference
+        resolved = reference.resolved
+        if isinstance(resolved, discord.Message):
+            self.message_cache.put(resolved)
+            return resolved
+        if isinstance(resolved, discord.DeletedReferencedMessage):
+            return None
+
+        cached = self.message_cache.get(reference.message_id)
+        if cached is None:
+            cached = discord.utils.get(self.bot.cached_messages, id=reference.message_id)
+            self.message_cache.put(cached)
+        if cached is not None:
+            return cached
+
+        # message.channel.fetch_message is the method to get the full object
+        logger.info(f"message cache miss, fetching {reference.message_id}")
+        fetched = await message.channel.fetch_message(reference.message_id)
+        self.message_cache.put(fetched)
+        return fetched
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before, after):
+        if after.id in self.message_cache:
+            self.message_cache.put(after)
 
-        await self._send_ai_response(ctx, thinking_msg, ai_response, message)
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        self.message_cache.evict(payload.message_id)
+        if self.scheduler.cancel(payload.message_id):
+            logger.info(f"message {payload.message_id} deleted, cancelled its request")
 
     @commands.Cog.listener()
     async def on_message(self, message):
         logger.info("listening in the chat cog")
+        self.message_cache.put(message)
 
         if message.author.id == self.bot.user.id:
             return
@@ -88,183 +239,304 @@ class ChatCog(commands.Cog):
             if self.bot.user in message.mentions:
                 await self.handle_reply_chain(message)
 
-   
-    async def _send_ai_response(self, ctx, msg, ai_response: str, reply_to=None):
-        """Send or edit message with AI response, handling chunking and filtering.
 
-        Removes content before reasoning/thinking tags and splits responses over limits,
-        safely handling multiline markdown code blocks without language tags.
-        """
-        logger.info(f"raw ai reply is: {ai_response}")
-        for tag in ["</thinking>", "</reasoning>", "</think>"]:
-            if tag in ai_response:
-                ai_response = ai_response.split(tag)[-1]
-                break
-        logger.info(f"ai reply after filtering: {ai_response}")
+    async def _answer(self, ctx, thinking_msg, payload, reply_to=None, users=()):
+        """Wait for a scheduler slot, then answer. While queued thinking_msg shows the
+        queue position; deleting the triggering message cancels the request."""
+        trigger = reply_to or ctx.message
 
-        # if we have to reply, delete the thinker, and then reply else we edit in place
-        if reply_to:
-            await msg.delete()
+        async def show_position(position):
+            nonlocal thinking_msg
+            thinking_msg = await thinking_msg.edit(content=f"🤔 Thinking... (queued, position {position})")
 
-        MAX_MSG_LEN = 1000
-        
-        if len(ai_response) <= MAX_MSG_LEN:
-            if reply_to:
-                await ctx.reply(f'{ai_response}')
-            else:
-                await msg.edit(content=f'{ai_response}')
+        ticket = None
+        queued_at = time.perf_counter()
+        try:
+            async with self.scheduler.slot(trigger.id, trigger.author.id, trigger.channel.id, show_position) as ticket:
+                METRICS.observe("queue_wait", time.perf_counter() - queued_at)
+                if ticket.position is not None:
+                    thinking_msg = await thinking_msg.edit(content="🤔 Thinking...")
+                await self._answer_now(ctx, thinking_msg, payload, reply_to, users)
+        except RequestCancelled:
+            logger.info(f"request for {trigger.id} cancelled while queued")
+            await self._delete_quietly(thinking_msg)
+        except asyncio.CancelledError:
+            if ticket is None or not ticket.cancelled:
+                raise
+            logger.info(f"request for {trigger.id} cancelled while running")
+            await self._delete_quietly(thinking_msg)
+
+    async def _delete_quietly(self, msg):
+        try:
+            await msg.delete()
+        except discord.HTTPException:
+            pass
+
+    async def _answer_now(self, ctx, thinking_msg, payload, reply_to=None, users=()):
+        """Query the model with payload and deliver the answer in place of thinking_msg.
+
+        The finished conversation is stored under every message of the answer so
+        a reply to any of them can continue from it."""
+        if self.stream:
+            reply = streaming.StreamingReply(thinking_msg, self.delivery, self.stream_edit_interval)
+            ai_response = await self.query_model(payload, on_text=reply.feed, channel_id=ctx.channel.id)
+            log_payload(logger, "raw ai reply", ai_response)
+            with METRICS.span("delivery"):
+                await reply.finish(ai_response)
+            sent = reply.messages
         else:
-            chunks = []
-            lines = ai_response.split('\n')
-            current_chunk = ""
-            
-            in_code_block = False
-
-            for line in lines:
-                is_toggle_line = False
-                # Check if this line opens or closes a code block
-                if line.strip().startswith("```"):
-                    is_toggle_line = True
-                    in_code_block = not in_code_block
-
-                # Reserve space to close the block if we are forced to break the chunk early
-                closing_padding = 4 if (in_code_block and not is_toggle_line) else 0
-
-                if len(current_chunk) + len(line) + 1 + closing_padding <= MAX_MSG_LEN:
-                    if current_chunk:
-                        current_chunk += '\n' + line
-                    else:
-                        current_chunk = line
-                else:
-                    # Current chunk is full, wrap it up
-                    if current_chunk:
-                        if in_code_block and not is_toggle_line:
-                            current_chunk += '\n```'
-                        chunks.append(current_chunk)
-                    
-                    # Start the next chunk (without language identifiers)
-                    prefix = "```\n" if (in_code_block and not is_toggle_line) else ""
-                    
-                    if len(prefix) + len(line) <= MAX_MSG_LEN:
-                        current_chunk = prefix + line
-                    else:
-                        # Fallback: Word-splitting for single lines that exceed MAX_MSG_LEN on their own
-                        words = line.split()
-                        current_chunk = prefix
-                        for word in words:
-                            if len(current_chunk) + len(word) + 1 + closing_padding <= MAX_MSG_LEN:
-                                if current_chunk and current_chunk != prefix:
-                                    current_chunk += ' ' + word
-                                else:
-                                    current_chunk += word
-                            else:
-                                if current_chunk:
-                                    if in_code_block:
-                                        current_chunk += '\n```'
-                                    chunks.append(current_chunk)
-                                current_chunk = prefix + word
-            
-            # Add the final chunk
-            if current_chunk:
-                if in_code_block and not current_chunk.strip().endswith("```"):
-                    current_chunk += '\n```'
-                chunks.append(current_chunk)
-
-            # Send chunks
-            for idx, chunk in enumerate(chunks):
-                if idx == 0:
-                    if reply_to:
-                        context = await self.bot.get_context(reply_to)
-                        new_msg = await context.reply(chunk)
-                    else:
-                        new_msg = await msg.edit(content=chunk)
-                else:
-                    new_msg = await ctx.reply(chunk)
-                
-                # Update context for the next reply to chain correctly
-                ctx = await self.bot.get_context(new_msg)
-
-
-    def construct_ctx_from_message_list(self, msgs, bot):
+            ai_response = await self.query_model(payload, channel_id=ctx.channel.id)
+            with METRICS.span("delivery"):
+                sent = await self._send_ai_response(thinking_msg, ai_response)
+
+        for sent_msg in sent:
+            self.message_cache.put(sent_msg)
+        history = payload["messages"][1:]
+        history.append({"role": "assistant", "content": parsing.strip_reasoning(ai_response)})
+        conversation = {"messages": history, "users": sorted(users)}
+        if self.session_field:
+            conversation["key"] = payload[self.session_field]
+        await self.conversations.put([sent_msg.id for sent_msg in sent], conversation)
+
+    async def _send_ai_response(self, msg, ai_response: str):
+        """Deliver the answer in place of the placeholder msg.
+
+        Removes content before reasoning/thinking tags and lays the rest out
+        with self.delivery. Returns the messages holding the answer.
+        """
+        log_payload(logger, "raw ai reply", ai_response)
+        ai_response = parsing.strip_reasoning(ai_response)
+        log_payload(logger, "ai reply after filtering", ai_response)
+        return await self.delivery.deliver(msg, ai_response)
+
+    async def _read_bot_turns(self, msgs) -> dict:
+        """Full text of our answers among msgs by message id. Long answers are
+        in embeds or an attached file rather than the message content"""
+        ours = [msg for msg in msgs if msg.author == self.bot.user]
+        texts = await asyncio.gather(*(self.delivery.read_back(msg) for msg in ours))
+        return {msg.id: text for msg, text in zip(ours, texts)}
+
+    def construct_ctx_from_message_list(self, msgs, bot, prior=None, model=None, bot_turns=None):
         """given a list of messages it returns a json payload of the chat history
-           along with a list of the users in the chain"""
+           along with a list of the users in the chain.
+           prior is a stored conversation the messages continue from,
+           model overrides the current model and bot_turns holds the text of
+           our own messages (see _read_bot_turns) where it differs from the content"""
+        with METRICS.span("build_context"):
+            return self._construct_ctx(msgs, bot, prior, model or self.current_model, bot_turns or {})
+
+    def _construct_ctx(self, msgs, bot, prior, model, bot_turns):
 
         user_names = set()
         history_messages = []
+        if prior is not None:
+            user_names.update(prior["users"])
+            history_messages.extend(prior["messages"])
+        trigger = msgs[-1]
         for msg in msgs:
             if msg.author != bot.user:
                 user_names.add(msg.author.name)
             if msg.author == bot.user:
-                history_messages.append({"role": "assistant", "content": msg.content})
+                history_messages.append({"role": "assistant", "content": bot_turns.get(msg.id, msg.content)})
             else:
                 history_messages.append({
                     "role": "user",
-                    "content": f"{msg.author.name}: {msg.content}"
+                    # only the triggering message's override picked the model
+                    "content": f"{msg.author.name}: {parsing.prompt_text(msg.content, msg is trigger)}"
                 })
 
         user_list = ", ".join(sorted(user_names))
 
+        messages = prompt_layout.build_messages(self.system_prompt, history_messages, user_list, self.prompt_layout)
+        messages, trimmed = self.context_builder.fit(messages, model)
+        if trimmed:
+            logger.info(f"trimmed {trimmed} tokens of history to fit the context budget of {model}")
+
         payload = {
-            "model": self.current_model,
-            "messages": [
-                {"role": "system", "content": self.system_prompt + f" The current users are {user_list}."},
-                *history_messages
-            ],
+            "model": model,
+            "messages": messages,
             "temperature": 0.7
         }
+        if self.cache_prompt:
+            payload["cache_prompt"] = True
+        if self.session_field:
+            # a stable per-thread key lets the backend route the thread to the slot holding its cache
+            payload[self.session_field] = prior.get("key") if prior and prior.get("key") else str(msgs[0].id)
 
         return payload, user_names
            
-    async def query_model(self, payload):
-        import json
-        payload["tools"] = self.tools
-
-        timeout = aiohttp.ClientTimeout(total=600)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{self.llm_url}/chat/completions", json=payload, timeout=timeout) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"raw reply packet: {data}")
-
-                    if data["choices"][0]["finish_reason"] == "tool_calls":
-                        tool_calls = data["choices"][0]["message"]["tool_calls"]
-                        payload["messages"].append(
-                                {
-                                    "role": "assistant",
-                                    "tool_calls": tool_calls,
-                                }
-                        )
-                        for tc in tool_calls:
-                            logger.info(f"asked for a tool! Tool name: {tc['function']['name']}")
-                            tool_name = tc['function']['name']
-                            tool_call_id = tc['id']
-                            tool_arguments_str = tc['function']['arguments']
-                            if tool_name not in tool_router.get_all_tool_names():
-                                tool_results = [("result", "invalid tool call!")]
-                            else:
-                                tool_arguments_dict = json.loads(tool_arguments_str)
-                                tool_result = await tool_router.route_tool(tool_name, **tool_arguments_dict)
-                            tool_result_dict = {
-                                "results" : [{x:y} for x,y in tool_result],
-                            }
-                            logger.info(f"tool result: {tool_result_dict}")
-                            payload["messages"].append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps(tool_result_dict),
-                            })
-                        
-                        ai_response = await self.query_model(payload)
-                    else:
-                        ai_response = data.get("choices", [{}])[0].get("message", {}).get("content", "No response from AI")
-                    
-                    logger.info(f'AI response received: {ai_response[:100]}...')
-                    
-                    return ai_response
-                else:
+    async def query_model(self, payload, on_text=None, channel_id=None):
+        """Run a chat completion, resolving tool calls along the way.
+
+        Each round's HTTP response is released before its tools run. The loop
+        stops after max_tool_rounds rounds (the last one is asked to answer
+        without tools) or when the wall clock budget runs out.
+        When streaming is enabled and on_text is given, the request is sent with
+        stream=true and on_text is awaited with each content delta.
+        Only the tools allowed for the model and channel_id are offered."""
+        tools = tool_router.tools_for(payload["model"], channel_id)
+        if tools and self.catalogue.supports_tools(payload["model"]) is False:
+            logger.info(f"{payload['model']} does not support tools, sending none")
+            tools = tool_router.NO_TOOLS
+        if tools:
+            payload["tools"] = tools
+        stream = self.stream and on_text is not None
+        if stream:
+            payload["stream"] = True
+            on_text = self._first_token_timer(on_text, time.perf_counter())
+
+        with METRICS.span("llm_total"):
+            return await self._agent_loop(payload, on_text, stream, tools)
+
+    def _first_token_timer(self, on_text, started):
+        """Wrap on_text to record the time until the first streamed delta"""
+        seen = False
+
+        async def timed(delta):
+            nonlocal seen
+            if not seen:
+                seen = True
+                METRICS.observe("llm_first_token", time.perf_counter() - started)
+            await on_text(delta)
+        return timed
+
+    async def _agent_loop(self, payload, on_text, stream, tools):
+        """The completion and tool rounds of query_model"""
+        started = time.monotonic()
+        for round_no in range(1, self.max_tool_rounds + 1):
+            remaining = self.total_budget - (time.monotonic() - started)
+            if remaining <= 0:
+                logger.error(f"agent loop ran out of its {self.total_budget}s budget after {round_no - 1} rounds")
+                return f"Stopped: the request took longer than {self.total_budget} seconds."
+            if round_no == self.max_tool_rounds and tools:
+                payload["tool_choice"] = "none"
+
+            round_started = time.monotonic()
+            finish_reason, message = await self._complete(payload, on_text, stream, min(self.request_timeout, remaining))
+            llm_time = time.monotonic() - round_started
+            METRICS.observe("llm_round", llm_time)
+
+            if finish_reason != "tool_calls" or not message.get("tool_calls"):
+                logger.info(f"round {round_no}: llm {llm_time:.2f}s, final answer")
+                ai_response = message.get("content") or "No response from AI"
+                logger.info(f'AI response received: {ai_response[:100]}...')
+                return ai_response
+
+            tool_calls = message["tool_calls"]
+            payload["messages"].append(
+                    {
+                        "role": "assistant",
+                        "tool_calls": tool_calls,
+                    }
+            )
+            tools_started = time.monotonic()
+            # the calls of one turn are independent, run them together
+            tool_results = await asyncio.gather(*(self._run_tool_call(tc, tools) for tc in tool_calls))
+            # gather keeps the order of tool_calls, so results line up with their ids
+            for tc, tool_result in zip(tool_calls, tool_results):
+                tool_result_dict = {
+                    "results" : [{x:y} for x,y in tool_result],
+                }
+                log_payload(logger, "tool result", tool_result_dict)
+                payload["messages"].append({
+                    "role": "tool",
+                    "tool_call_id": tc['id'],
+                    "content": json.dumps(tool_result_dict),
+                })
+            logger.info(f"round {round_no}: llm {llm_time:.2f}s, {len(tool_calls)} tools {time.monotonic() - tools_started:.2f}s")
+
+        return f"Stopped after {self.max_tool_rounds} tool rounds without a final answer."
+
+    async def _complete(self, payload, on_text, stream, timeout_s):
+        """Send one completion round and read it fully, releasing the connection
+        before returning. Returns (finish_reason, message)"""
+        body = tool_router.encode_payload(payload)
+        reuse = self.prefix_tracker.observe(body)
+        logger.info(f"prompt prefix reuse: {reuse:.0%}")
+
+        backend, response = await self.router.post(
+            self.session, payload["model"], "/chat/completions",
+            body, JSON_HEADERS, timeout_s, stream)
+        error = None
+        timed_out = False
+        try:
+            async with response:
+                if response.status != 200:
                     error_text = await response.text()
                     logger.error(f'LLM API error: {response.status} - {error_text}')
-                    return 'Error from AI server: {response.status}'
+                    if response.status >= 500:
+                        error = f"HTTP {response.status}"
+                    return "error", {"content": f'Error from AI server: {response.status}'}
+                if stream:
+                    finish_reason, message = await streaming.read_stream(response, on_text)
+                    log_payload(logger, "raw streamed reply", message)
+                else:
+                    data = await response.json()
+                    log_payload(logger, "raw reply packet", data)
+                    choice = data.get("choices", [{}])[0]
+                    finish_reason, message = choice.get("finish_reason"), choice.get("message", {})
+                return finish_reason, message
+        except asyncio.TimeoutError:
+            # a slow answer is not a dead backend
+            timed_out = True
+            raise
+        except aiohttp.ClientError as e:
+            # a dropped stream counts against the backend's breaker
+            error = e
+            raise
+        finally:
+            self.router.release(backend, error=error, timed_out=timed_out)
+
+    async def _run_tool_call(self, tc, tools):
+        """Run one requested tool under its concurrency limit and the per-call timeout.
+        Only the tools offered in this request (the ToolSet tools) may run"""
+        tool_name = tc['function']['name']
+        logger.info(f"asked for a tool! Tool name: {tool_name}")
+        if tool_name not in tools.names:
+            return [("result", "invalid tool call!")]
+        try:
+            tool_arguments_dict = json.loads(tc['function']['arguments'] or "{}")
+        except json.JSONDecodeError as e:
+            return [("result", f"invalid tool arguments: {e}")]
+
+        limit = self.tool_limits.setdefault(tool_name, asyncio.Semaphore(self.tool_concurrency))
+        try:
+            async with limit:
+                return await asyncio.wait_for(
+                    tool_router.route_tool(tool_name, **tool_arguments_dict), timeout=self.tool_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"tool {tool_name} timed out after {self.tool_timeout}s")
+            return [("result", f"tool timed out after {self.tool_timeout} seconds")]
+        except Exception as e:
+            logger.error(f"tool {tool_name} failed: {e}")
+            return [("result", f"tool failed: {e}")]
+
+    @commands.command(name='cache_stats')
+    async def cache_stats(self, ctx):
+        """Shows prompt prefix reuse, message cache and tool cache hit rates"""
+        prefix = self.prefix_tracker.stats()
+        messages = self.message_cache.stats()
+        await ctx.send(
+            f"Prompt prefix reuse: {prefix['reuse_ratio']:.0%} over {prefix['requests']} requests\n"
+            f"Message cache: {messages['size']} cached, {messages['hits']} hits, {messages['misses']} misses"
+            + "".join(f"\n{name}: " + ", ".join(f"{k} {v}" for k, v in counters.items())
+                      for name, counters in tool_router.stats().items())
+        )
+
+    @commands.command(name='perf')
+    async def perf(self, ctx):
+        """Shows p50/p95/p99 latency of each stage between a message and the reply"""
+        rows = METRICS.snapshot()
+        if not rows:
+            await ctx.send("No timings recorded yet.")
+            return
+        lines = [f"{'stage':<32} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}"]
+        for row in rows:
+            label = row["name"] + "".join(f" {v}" for v in row["labels"].values())
+            lines.append(
+                f"{label[:32]:<32} {row['count']:>6} "
+                + " ".join(f"{row[q] * 1000:>6.0f}ms" for q in ("p50", "p95", "p99")))
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
 
     @commands.command(name='get_system_prompt')
     async def get_system_prompt(self, ctx):
@@ -278,11 +550,16 @@ class ChatCog(commands.Cog):
     async def chat_history(self, ctx, num_messages: int, *, message: str):
         """Responds to the user using the OpenAI-compatible LLM with chat history"""
         try:
+            model, clean_message = parsing.extract_model(message, self.current_model)
             logger.info(f'Chat history command invoked by {ctx.author} in {ctx.guild.name if ctx.guild else "DM"}: {clean_message} (model: {model}, history: {num_messages} messages)')
 
             if not clean_message:
                 await ctx.send('Please provide a message to send to the AI.')
                 return
+            problem = self._unknown_model(model)
+            if problem:
+                await ctx.reply(problem)
+                return
 
             if num_messages < 1 or num_messages > 200:
                 await ctx.send('Please provide a number between 1 and 200 for message history.')
@@ -292,14 +569,14 @@ class ChatCog(commands.Cog):
             messages = [msg async for msg in channel.history(limit=num_messages+1)]
             messages = messages[::-1]
 
-            thinking_msg = await ctx.send("🤔 Thinking...")
+            thinking_msg = await ctx.reply("🤔 Thinking...")
             
-            payload, users = self.construct_ctx_from_message_list(messages, ctx.bot)
+            bot_turns = await self._read_bot_turns(messages)
+            payload, users = self.construct_ctx_from_message_list(messages, ctx.bot, model=model, bot_turns=bot_turns)
 
-            logger.info(f"sending chat: {payload}")
+            log_payload(logger, "sending chat", payload)
 
-            ai_response = await query_model(payload)
-            await self._send_ai_response(ctx, thinking_msg, ai_response, ctx.message)
+            await self._answer(ctx, thinking_msg, payload, ctx.message, users)
 
         except aiohttp.ClientError as e:
             logger.error(f'Network error calling LLM: {str(e)}')
@@ -312,12 +589,16 @@ class ChatCog(commands.Cog):
     async def chat(self, ctx, *, message: str):
         """Responds to the user using the OpenAI-compatible LLM"""
         try:
-            model, clean_message = self.extract_model(message)
+            model, clean_message = parsing.extract_model(message, self.current_model)
             logger.info(f'Chat command invoked by {ctx.author} in {ctx.guild.name if ctx.guild else "DM"}: {clean_message} (model: {model})')
 
             if not clean_message:
                 await ctx.send('Please provide a message to send to the AI.')
                 return
+            problem = self._unknown_model(model)
+            if problem:
+                await ctx.reply(problem)
+                return
             
             # if the message has a reply, then add both to the chain.
             msg_handle = ctx.message
@@ -326,70 +607,68 @@ class ChatCog(commands.Cog):
                 return
 
             # Send a message to the user that we're thinking
-            thinking_msg = await ctx.send("🤔 Thinking...")
-            payload, _ = self.construct_ctx_from_message_list([ctx.message], self.bot)
-            ai_response = await self.query_model(payload)
-            await self._send_ai_response(ctx, thinking_msg, ai_response, ctx.message)
+            thinking_msg = await ctx.reply("🤔 Thinking...")
+            payload, users = self.construct_ctx_from_message_list([ctx.message], self.bot, model=model)
+            await self._answer(ctx, thinking_msg, payload, ctx.message, users)
 
         except aiohttp.ClientError as e:
             logger.error(f'Network error calling LLM: {str(e)}')
             await thinking_msg.edit(content=f'Network error: {str(e)}')
         except Exception as e:
-            import traceback
             logger.error(f'Error in chat command: {str(e)}')
             logger.error(f'trace: {traceback.format_exc()}')
             await thinking_msg.edit(content=f'Error: {str(e)}')
 
+    def _unknown_model(self, model: str):
+        """A message for the user when model is not in the catalogue, else None"""
+        known, suggestions = self.catalogue.check(model)
+        if known:
+            return None
+        hint = f" Did you mean {', '.join(f'`{name}`' for name in suggestions)}?" if suggestions else ""
+        return f"Unknown model `{model}`.{hint} See `!models` for the available ones."
+
     @commands.command(name='models', aliases=['list_models', 'available_models'])
     async def models(self, ctx):
-        """Lists all available models from the LLM server"""
+        """Lists the models served by the LLM backends, from the model catalogue"""
         try:
             logger.info(f'Models command invoked by {ctx.author}')
 
-            # Send a message to the user that we're fetching models
-            msg = await ctx.send("🔍 Fetching available models...")
-
-            # Send GET request to fetch models
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.llm_url}/models") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        models = data.get("data", [])
-                        
-                        if models:
-                            model_list = "\n".join([f"  - {model.get('id', 'Unknown')}" for model in models])
-                            await msg.edit(content=f"🤖 Available models:\n{model_list}\nCurrent model: {self.current_model}")
-                        else:
-                            await msg.edit(content="No models found from the AI server.")
-                        
-                        logger.info(f'Models fetched: {len(models)} models available')
-                    else:
-                        error_text = await response.text()
-                        logger.error(f'Models API error: {response.status} - {error_text}')
-                        await msg.edit(content=f'Error fetching models: {response.status}')
+            # only go to the network when the background refresh has not succeeded yet
+            if not self.catalogue.loaded:
+                await self.catalogue.refresh(self.session)
+
+            # health and circuit breaker state of every backend
+            backends = "\n".join([f"  - {backend.describe()}" for backend in self.router.backends])
+            if self.catalogue.models:
+                model_list = "\n".join([f"  - {info.describe()}" for info in self.catalogue.models.values()])
+                await ctx.send(f"🤖 Available models (as of {self.catalogue.age():.0f}s ago):\n{model_list}\n"
+                               f"Current model: {self.current_model}\nBackends:\n{backends}")
+            else:
+                await ctx.send(f"No models found from the AI servers:\n{backends}")
+
+            logger.info(f'Models listed: {len(self.catalogue.models)} models available')
 
-        except aiohttp.ClientError as e:
-            logger.error(f'Network error fetching models: {str(e)}')
-            await msg.edit(content=f'Network error: {str(e)}')
         except Exception as e:
             logger.error(f'Error in models command: {str(e)}')
-            await msg.edit(content=f'Error: {str(e)}')
+            await ctx.send(f'Error: {str(e)}')
 
     @commands.command(name='load', aliases=['load_model', 'use_model'])
     async def load(self, ctx, model: str):
-        """Loads a model from the LLM server and sets it as the default for chat commands"""
+        """Sets a model served by the LLM backends as the default for chat commands"""
         try:
             logger.info(f'Load command invoked by {ctx.author}: {model}')
 
-            # Send a message to the user that we're loading the model
-            msg = await ctx.send(f"📦 Loading model: `{model}`...")
+            problem = self._unknown_model(model)
+            if problem:
+                await ctx.send(problem)
+                return
 
             self.current_model = model
-            await msg.edit(content=f"default using model: `{model}` :)")
+            await ctx.send(f"default using model: `{model}` :)")
 
         except Exception as e:
             logger.error(f'Error in load command: {str(e)}')
-            await msg.edit(content=f'Error: {str(e)}')
+            await ctx.send(f'Error: {str(e)}')
 
 async def setup(bot):
     """Setup function for the cog - called by the bot"""
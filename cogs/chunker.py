@@ -0,0 +1,117 @@
+import re
+
+# discord's limit on the length of one message
+DISCORD_MAX_LEN = 2000
+
+LIST_ITEM = re.compile(r'\s*(?:[-*+]|\d{1,9}[.)])\s')
+# reopening a fence with a very long info string would eat the chunk
+MAX_REOPEN_LEN = 64
+
+
+def _fence_run(stripped: str) -> str:
+    """The run of backticks opening a fence line"""
+    return stripped[:len(stripped) - len(stripped.lstrip('`'))]
+
+
+def split_message(text: str, limit: int = DISCORD_MAX_LEN) -> list:
+    """Split text into chunks of at most limit characters.
+
+    Chunks end on line boundaries, preferably in front of a paragraph, list
+    item, table or code block rather than inside one. A code block cut in two
+    is closed at the end of the first chunk and reopened, with its language
+    tag, at the start of the next. Lines longer than a chunk are split at the
+    last space that fits. Joining the chunks with newlines gives back the text
+    whenever no line was split and no fence had to be reopened.
+
+    Runs in linear time: lines are collected in lists and each chunk is joined once."""
+    if len(text) <= limit:
+        return [text]
+
+    lines = text.split('\n')
+    chunks = []
+    current = []  # lines of the chunk being built
+    current_len = 0
+    prefix_lines = 0  # 1 when current starts with a reopened fence
+    fence = None  # opening line of the code block we are in
+    closer = ""
+    opener_at = None  # position in current of the line that opened that block
+    # (position in current, index into lines, fence, closer, current_len) at the latest good cut
+    cut = None
+    prev_blank = prev_table = prev_closed = False
+
+    def emit(chunk_lines, chunk_fence, chunk_closer):
+        body = '\n'.join(chunk_lines)
+        if chunk_fence:
+            chunks.append(f"{body}\n{chunk_closer}")
+        elif body.strip():
+            # discord refuses blank messages
+            chunks.append(body)
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.lstrip()
+        toggles = stripped.startswith('```') and (fence is None or stripped.startswith(closer))
+        if toggles:
+            new_fence, new_closer = (None, "") if fence else (stripped, _fence_run(stripped))
+        else:
+            new_fence, new_closer = fence, closer
+        # room to close the block if the chunk has to end after this line
+        reserve = len(new_closer) + 1 if new_fence else 0
+        need = len(line) + (1 if current else 0)
+
+        if current_len + need + reserve <= limit:
+            if len(current) > prefix_lines and fence is None:
+                is_table = stripped.startswith('|')
+                if (prev_blank or prev_closed or toggles or LIST_ITEM.match(line)
+                        or is_table != prev_table):
+                    cut = (len(current), i, fence, closer, current_len)
+            if toggles and new_fence is not None:
+                opener_at = len(current)
+            current.append(line)
+            current_len += need
+            fence, closer = new_fence, new_closer
+            prev_blank = not stripped
+            prev_table = stripped.startswith('|') and fence is None
+            prev_closed = toggles and fence is None
+            i += 1
+            continue
+
+        # a block opened on the last line has nothing in it yet
+        opener_last = fence is not None and opener_at == len(current) - 1 and opener_at >= prefix_lines
+        if any(part.strip() for part in current[prefix_lines:len(current) - opener_last]):
+            # full: end the chunk at the latest good cut if that keeps it at least half full
+            if cut is not None and cut[4] >= limit // 2:
+                position, i, cut_fence, cut_closer, _ = cut
+                emit(current[:position], cut_fence, cut_closer)
+                fence, closer = cut_fence, cut_closer
+            elif opener_last:
+                # carry the opener over rather than send an empty block
+                emit(current[:-1], None, "")
+            else:
+                emit(current, fence, closer)
+        else:
+            # the line alone does not fit: split it at the last space in reach
+            room = max(limit - current_len - (1 if current else 0) - reserve, 1)
+            split_at = line.rfind(' ', 0, room)
+            if split_at < room // 2:
+                split_at = room
+            else:
+                split_at += 1
+            current.append(line[:split_at])
+            lines[i] = line[split_at:]
+            # a fence line keeps its meaning in the head, and reserve has room for the closer that needs
+            fence, closer = new_fence, new_closer
+            emit(current, fence, closer)
+
+        reopen = fence if fence is None or len(fence) <= MAX_REOPEN_LEN else closer
+        current = [reopen] if fence else []
+        current_len = len(reopen) if fence else 0
+        prefix_lines = len(current)
+        opener_at = 0 if fence else None
+        cut = None
+        prev_blank = prev_table = prev_closed = False
+
+    if len(current) > prefix_lines:
+        emit(current, fence, closer)
+    return chunks
@@ -0,0 +1,174 @@
+import functools
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# rough per message cost of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class HeuristicTokenizer:
+    """Fast token estimate from the character count"""
+
+    def __init__(self, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str):
+        import tiktoken
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class HFTokenizer:
+    """Tokenizer from the `tokenizers` package, given a tokenizer.json path or a hub name"""
+
+    def __init__(self, name: str):
+        from tokenizers import Tokenizer
+        if name.endswith(".json"):
+            self._tokenizer = Tokenizer.from_file(name)
+        else:
+            self._tokenizer = Tokenizer.from_pretrained(name)
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def load_tokenizer(spec: str = "heuristic", chars_per_token: float = 4.0):
+    """Build a tokenizer from a spec like 'heuristic', 'tiktoken:cl100k_base' or 'hf:Qwen/Qwen3-8B'.
+    Falls back to the character heuristic when the backing package is missing."""
+    kind, _, name = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            return TiktokenTokenizer(name or "cl100k_base")
+        if kind == "hf":
+            return HFTokenizer(name)
+    except Exception as e:
+        logger.warning(f"could not load tokenizer {spec} ({e}), using character heuristic")
+    return HeuristicTokenizer(chars_per_token)
+
+
+class ContextBuilder:
+    """Fits a chat message list into a per-model token budget.
+
+    The system prompt (first message) and the latest request (last message) are
+    always kept. Older turns are dropped oldest first, or, in 'summarize' mode,
+    replaced by a short note listing what the dropped user turns were about."""
+
+    def __init__(self, tokenizer, default_budget: int = 8192, model_budgets: dict = None,
+                 reserve_tokens: int = 1024, overflow: str = "drop", summary_chars: int = 120,
+                 context_length=None):
+        self.tokenizer = tokenizer
+        self.default_budget = default_budget
+        self.model_budgets = model_budgets or {}
+        # model -> context window reported by the server (or None), used when model_budgets has no entry
+        self.context_length = context_length
+        self.reserve_tokens = reserve_tokens
+        self.overflow = overflow
+        self.summary_chars = summary_chars
+        self._count_text = functools.lru_cache(maxsize=4096)(tokenizer.count)
+
+    def budget_for(self, model: str) -> int:
+        """Prompt tokens available for model, leaving reserve_tokens for the answer"""
+        budget = self.model_budgets.get(model)
+        if budget is None and self.context_length is not None:
+            budget = self.context_length(model)
+        return (budget or self.default_budget) - self.reserve_tokens
+
+    def count_message(self, message: dict) -> int:
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if content:
+            tokens += self._count_text(content)
+        if message.get("tool_calls"):
+            tokens += self._count_text(json.dumps(message["tool_calls"]))
+        return tokens
+
+    def count(self, messages: list) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+    def _turns(self, messages: list) -> list:
+        """Group messages into turns: a user message plus the assistant/tool messages after it,
+        so tool results are never separated from the call that produced them"""
+        turns = []
+        for message in messages:
+            if message["role"] == "user" or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return turns
+
+    def _summarize(self, dropped: list) -> dict:
+        lines = []
+        for message in dropped:
+            if message["role"] == "user" and message.get("content"):
+                first_line = message["content"].strip().split("\n", 1)[0]
+                lines.append(f"- {first_line[:self.summary_chars]}")
+        # a user message, since many chat templates only allow the system message first
+        return {
+            "role": "user",
+            "content": f"[{len(dropped)} earlier messages were trimmed. Earlier requests were:\n" + "\n".join(lines) + "]",
+        }
+
+    def fit(self, messages: list, model: str) -> tuple[list, int]:
+        """Return (messages that fit the budget of model, number of tokens trimmed)"""
+        budget = self.budget_for(model)
+        total = self.count(messages)
+        if total <= budget or len(messages) <= 2:
+            return messages, 0
+
+        system, history, latest = messages[0], messages[1:-1], messages[-1]
+        turns = self._turns(history)
+        turn_tokens = [self.count(turn) for turn in turns]
+        fixed = self.count_message(system) + self.count_message(latest)
+
+        kept_tokens = sum(turn_tokens)
+        dropped = []
+        first_kept = 0
+        summary = None
+        while first_kept < len(turns):
+            summary = self._summarize(dropped) if dropped and self.overflow == "summarize" else None
+            summary_tokens = self.count_message(summary) if summary else 0
+            if fixed + kept_tokens + summary_tokens <= budget:
+                break
+            dropped.extend(turns[first_kept])
+            kept_tokens -= turn_tokens[first_kept]
+            first_kept += 1
+        else:
+            summary = self._summarize(dropped) if dropped and self.overflow == "summarize" else None
+            if summary and fixed + self.count_message(summary) > budget:
+                summary = None
+
+        kept = [system]
+        if summary:
+            kept.append(summary)
+        for turn in turns[first_kept:]:
+            kept.extend(turn)
+        kept.append(latest)
+
+        trimmed = total - self.count(kept)
+        if fixed > budget:
+            logger.warning(f"system prompt and latest request alone need {fixed} tokens, budget for {model} is {budget}")
+        return kept, trimmed
+
+
+def from_config(config: dict, context_length=None) -> ContextBuilder:
+    """Build a ContextBuilder from the 'context' block of model_env.
+    context_length looks up a model's context window when model_budgets does not set one"""
+    tokenizer = load_tokenizer(config.get('tokenizer', 'heuristic'), config.get('chars_per_token', 4.0))
+    return ContextBuilder(
+        tokenizer,
+        default_budget=config.get('default_budget', 8192),
+        model_budgets=config.get('model_budgets', {}),
+        reserve_tokens=config.get('reserve_tokens', 1024),
+        overflow=config.get('overflow', 'drop'),
+        context_length=context_length,
+    )
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from cogs.sqlite_worker import SQLiteWorker
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryConversationStore:
+    """Keeps built conversations in memory, keyed by the id of the bot reply that ended them.
+
+    A conversation is a dict with the "messages" sent to the model (without the
+    system prompt, but with assistant tool_calls and tool results) and the
+    "users" taking part. Entries expire after ttl seconds."""
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # message id -> (stored_at, conversation)
+
+    async def get(self, message_id):
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return None
+        stored_at, conversation = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[message_id]
+            return None
+        return conversation
+
+    async def put(self, message_ids, conversation):
+        now = time.time()
+        for message_id in message_ids:
+            self._entries[message_id] = (now, conversation)
+            self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # entries are in insertion order, so expired ones sit at the front
+        while self._entries:
+            oldest_id, (stored_at, _) = next(iter(self._entries.items()))
+            if now - stored_at <= self.ttl:
+                break
+            del self._entries[oldest_id]
+
+    def close(self):
+        self._entries.clear()
+
+
+class SQLiteConversationStore:
+    """Same interface as MemoryConversationStore, persisted to a SQLite file so
+    threads can be continued after a restart.
+
+    Queries run on a SQLiteWorker, off the event loop."""
+
+    def __init__(self, path: str = "conversations.db", ttl: float = 86400):
+        self.ttl = ttl
+        self._db = SQLiteWorker(path, (
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " message_id INTEGER PRIMARY KEY,"
+            " stored_at REAL NOT NULL,"
+            " conversation TEXT NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS conversations_age ON conversations (stored_at)",
+        ), thread_name="conversations")
+        logger.info(f"conversation store opened at {path}")
+
+    async def get(self, message_id):
+        return await self._db.run(self._get, message_id)
+
+    def _get(self, db, message_id):
+        row = db.execute(
+            "SELECT conversation FROM conversations WHERE message_id = ? AND stored_at >= ?",
+            (message_id, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    async def put(self, message_ids, conversation):
+        await self._db.run(self._put, message_ids, conversation)
+
+    def _put(self, db, message_ids, conversation):
+        now = time.time()
+        blob = json.dumps(conversation)
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO conversations (message_id, stored_at, conversation) VALUES (?, ?, ?)",
+                [(message_id, now, blob) for message_id in message_ids],
+            )
+            db.execute("DELETE FROM conversations WHERE stored_at < ?", (now - self.ttl,))
+
+    def close(self):
+        self._db.close()
+
+
+def open_store(config: dict):
+    """Build the conversation store described by the 'conversation_store' block of model_env"""
+    backend = config.get('backend', 'memory')
+    ttl = config.get('ttl', 86400)
+    if backend == 'sqlite':
+        return SQLiteConversationStore(config.get('path', 'conversations.db'), ttl)
+    if backend == 'memory':
+        return MemoryConversationStore(ttl, config.get('max_entries', 10000))
+    raise ValueError(f"unknown conversation store backend: {backend}")
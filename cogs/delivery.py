@@ -0,0 +1,98 @@
+import io
+import logging
+
+import discord
+
+from cogs.chunker import DISCORD_MAX_LEN, split_message
+
+logger = logging.getLogger(__name__)
+
+# discord's limit on the description of one embed
+EMBED_MAX_LEN = 4096
+PREVIEW_LEN = 1500
+
+
+class Delivery:
+    """Lays an answer out over as few discord messages as possible.
+
+    "text" sends plain message chunks of up to 2000 characters, "embed" puts
+    up to 4096 characters in each message's embed and "auto" uses plain text
+    when the answer fits one message and embeds otherwise. Answers longer than
+    file_threshold characters become a preview plus the full text as a file
+    attachment, all in a single edit of the placeholder. Follow up messages
+    reply to the previous one directly, without building a context per chunk."""
+
+    def __init__(self, mode: str = "auto", file_threshold: int = 16000, file_name: str = "answer.md"):
+        if mode not in ("text", "embed", "auto"):
+            raise ValueError(f"unknown delivery mode: {mode}")
+        self.mode = mode
+        self.file_threshold = file_threshold
+        self.file_name = file_name
+
+    def wants_file(self, text: str) -> bool:
+        return bool(self.file_threshold) and len(text) > self.file_threshold
+
+    def preview(self, text: str) -> str:
+        return split_message(text[:PREVIEW_LEN * 2], PREVIEW_LEN)[0]
+
+    def layout(self, text: str) -> list:
+        """(chunk, as_embed) for each message the answer takes. Over the file
+        threshold that is just the preview; the file is attached once the answer is final"""
+        if self.wants_file(text):
+            return [(self.preview(text), False)]
+        if self.mode == "text" or (self.mode == "auto" and len(text) <= DISCORD_MAX_LEN):
+            return [(chunk, False) for chunk in split_message(text, DISCORD_MAX_LEN)]
+        return [(chunk, True) for chunk in split_message(text, EMBED_MAX_LEN)]
+
+    @staticmethod
+    def message_kwargs(chunk: str, as_embed: bool) -> dict:
+        """Arguments for Message.edit / Message.reply showing chunk"""
+        if as_embed:
+            return {"content": None, "embed": discord.Embed(description=chunk)}
+        return {"content": chunk, "embed": None}
+
+    def file_kwargs(self, text: str) -> dict:
+        return {
+            "content": f"{self.preview(text)}\n*(full answer attached, {len(text)} characters)*",
+            "embed": None,
+            "attachments": [discord.File(io.BytesIO(text.encode()), filename=self.file_name)],
+        }
+
+    async def deliver(self, placeholder, text: str) -> list:
+        """Replace placeholder with text. Returns the messages holding the answer"""
+        if not text.strip():
+            text = "No response from AI"
+        if self.wants_file(text):
+            logger.info(f"sending a {len(text)} character answer as {self.file_name}")
+            return [await placeholder.edit(**self.file_kwargs(text))]
+
+        sent = []
+        for idx, (chunk, as_embed) in enumerate(self.layout(text)):
+            if idx == 0:
+                sent.append(await placeholder.edit(**self.message_kwargs(chunk, as_embed)))
+            else:
+                sent.append(await sent[-1].reply(**self.message_kwargs(chunk, as_embed)))
+        return sent
+
+    async def read_back(self, message) -> str:
+        """The answer a delivered message holds: the attached file when there
+        is one, else its embeds, else its content"""
+        for attachment in message.attachments:
+            if attachment.filename == self.file_name:
+                try:
+                    return (await attachment.read()).decode(errors="replace")
+                except discord.HTTPException as e:
+                    logger.error(f"could not read back {attachment.filename} of {message.id}: {e}")
+        described = [embed.description for embed in message.embeds if embed.description]
+        if described:
+            return "\n".join(described)
+        return message.content
+
+
+def from_config(config: dict) -> Delivery:
+    """Build the delivery described by the 'delivery' block of model_env"""
+    return Delivery(
+        mode=config.get('mode', 'auto'),
+        file_threshold=config.get('file_threshold', 16000),
+        file_name=config.get('file_name', 'answer.md'),
+    )
@@ -0,0 +1,359 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class BackendUnavailable(aiohttp.ClientConnectionError):
+    """Every backend serving the model has its circuit open"""
+
+
+class CircuitBreaker:
+    """Closed while requests succeed. Opens after failure_threshold consecutive
+    failures and fails fast for reset_timeout seconds, then lets a single trial
+    request through (half-open) whose outcome closes or reopens it"""
+
+    def __init__(self, failure_threshold: int = 2, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def try_trial(self) -> bool:
+        """Move an open breaker whose cool-down is over to half-open"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return True
+        return False
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure opened the circuit"""
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_timeout(self) -> bool:
+        """A slow answer is not a failure, except as the trial of a half-open circuit"""
+        if self.state == "half_open":
+            return self.record_failure()
+        return False
+
+    def record_success(self) -> bool:
+        """Returns True when this success closed an open or half-open circuit"""
+        was_open = self.state != "closed"
+        self.state = "closed"
+        self.failures = 0
+        return was_open
+
+    def retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def describe(self) -> str:
+        if self.state == "open":
+            return f"circuit open, retry in {self.retry_in():.0f}s"
+        if self.state == "half_open":
+            return "circuit half-open"
+        return "circuit closed"
+
+
+def parse_retry_after(value) -> float:
+    """Seconds to wait from a Retry-After header (delay seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """Timeouts and retries of the LLM requests.
+
+    connect_timeout bounds opening a connection, read_timeout the gap between
+    reads of a stream (so a stalled stream fails without waiting out the whole
+    request), the caller's budget the total. A non-streamed answer sends nothing
+    until it is done, so only the budget bounds it. Connection errors, connect
+    timeouts and retry_statuses are retried up to max_attempts with full jitter
+    exponential backoff, or after Retry-After when the server sends one and it
+    is no longer than max_retry_after. Other timeouts fire after the request was
+    sent and are not retried: the backend is busy generating, not down."""
+
+    def __init__(self, connect_timeout: float = 10, read_timeout: float = 300, max_attempts: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 20, max_retry_after: float = 60,
+                 retry_statuses=(429, 502, 503, 504)):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def timeout(self, total: float, stream: bool = False) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=total, sock_connect=min(self.connect_timeout, total),
+            sock_read=self.read_timeout if stream else None)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+class Backend:
+    """One OpenAI-compatible inference server"""
+
+    def __init__(self, url: str, models=None, breaker=None):
+        self.url = f"{url.rstrip('/')}/v1"
+        # models from model_env; empty means "whatever the server lists"
+        self.configured_models = set(models or [])
+        self.listed_models = []
+        self.outstanding = 0
+        self.latency_ewma = None
+        self.breaker = breaker or CircuitBreaker()
+        self.last_error = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state == "closed"
+
+    def serves(self, model: str) -> bool:
+        if self.configured_models:
+            return model in self.configured_models
+        if self.listed_models:
+            return model in self.listed_models
+        return True
+
+    def describe(self) -> str:
+        state = "up" if self.healthy else f"down ({self.last_error})"
+        latency = f"{self.latency_ewma * 1000:.0f}ms" if self.latency_ewma is not None else "n/a"
+        return f"{self.url} [{state}, {self.breaker.describe()}, {self.outstanding} in flight, latency {latency}]"
+
+
+class BackendRouter:
+    """Spreads LLM requests over several backends.
+
+    Picks among the healthy backends serving the requested model, either by
+    fewest outstanding requests ("least_outstanding") or by latency EWMA scaled
+    by load ("ewma"). Each backend has a circuit breaker that opens after
+    consecutive failures; while every backend of a model is open, requests fail
+    fast instead of waiting on timeouts. A background task probes /v1/models on
+    every backend and closes the breaker of nodes that answer again."""
+
+    def __init__(self, backends, strategy: str = "least_outstanding", ewma_alpha: float = 0.3,
+                 probe_interval: float = 30, probe_timeout: float = 5, retry: RetryPolicy = None):
+        self.backends = backends
+        self.strategy = strategy
+        self.ewma_alpha = ewma_alpha
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.retry = retry or RetryPolicy()
+        self._probe_task = None
+        self._probe_listeners = []
+
+    def _score(self, backend):
+        if self.strategy == "ewma":
+            latency = backend.latency_ewma if backend.latency_ewma is not None else 0.0
+            return (latency * (backend.outstanding + 1), backend.outstanding)
+        return (backend.outstanding, backend.latency_ewma or 0.0)
+
+    def acquire(self, model: str, exclude=()):
+        """Pick a backend for model and count the request against it.
+        Returns None when out of options, raises BackendUnavailable when every
+        backend serving the model has its circuit open"""
+        serving = [b for b in self.backends if b.serves(model) and b not in exclude]
+        if not serving:
+            return None
+        candidates = [b for b in serving if b.healthy]
+        if candidates:
+            backend = min(candidates, key=self._score)
+        else:
+            # at most one trial request per open circuit once its cool-down is over
+            backend = next((b for b in serving if b.breaker.try_trial()), None)
+            if backend is None:
+                retry_in = min(b.breaker.retry_in() for b in serving)
+                raise BackendUnavailable(f"no backend for {model} is up, retrying in {retry_in:.0f}s")
+        backend.outstanding += 1
+        return backend
+
+    def release(self, backend, error=None, timed_out: bool = False):
+        """Finish a request started with acquire. A timeout after the request
+        was sent only counts against a half-open circuit"""
+        backend.outstanding -= 1
+        if timed_out:
+            if backend.breaker.record_timeout():
+                logger.warning(f"reopening circuit of backend {backend.url}: trial request timed out")
+        elif error is not None:
+            self._record_failure(backend, error)
+        else:
+            self._record_success(backend)
+
+    def observe_latency(self, backend, latency: float):
+        if backend.latency_ewma is None:
+            backend.latency_ewma = latency
+        else:
+            backend.latency_ewma += self.ewma_alpha * (latency - backend.latency_ewma)
+
+    def _record_failure(self, backend, error):
+        backend.last_error = str(error) or error.__class__.__name__
+        if backend.breaker.record_failure():
+            logger.warning(f"opening circuit of backend {backend.url}: {backend.last_error}")
+
+    def _record_success(self, backend):
+        if backend.breaker.record_success():
+            logger.info(f"backend {backend.url} is healthy again")
+
+    async def post(self, session, model: str, path: str, body: bytes, headers: dict, budget: float,
+                   stream: bool = False):
+        """POST body to path on a backend serving model, within budget seconds.
+
+        Fails over to other backends on connection errors and retries with
+        backoff per the RetryPolicy. Only the wait for the response headers is
+        retried and a timeout after the request went out is raised as is, so an
+        answer is never generated twice. A retried status means the backend is
+        busy, not down, and does not count against its breaker. Returns
+        (backend, response) with the response open; the last retryable response
+        is returned as is once the attempts or the budget run out. Release the
+        backend when done."""
+        deadline = time.monotonic() + budget
+        tried = []
+        for attempt in range(1, self.retry.max_attempts + 1):
+            try:
+                backend = self.acquire(model, exclude=tried)
+            except BackendUnavailable:
+                if not tried:
+                    raise
+                backend = None
+            if backend is None and tried:
+                # every backend has had a go this round, start over
+                tried = []
+                backend = self.acquire(model)
+            if backend is None:
+                raise aiohttp.ClientConnectionError(f"no reachable backend serves {model}")
+            last_attempt = attempt == self.retry.max_attempts
+            started = time.monotonic()
+            remaining = deadline - started
+            try:
+                response = await session.post(
+                    f"{backend.url}{path}", data=body, headers=headers, timeout=self.retry.timeout(remaining, stream))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError) and not isinstance(e, aiohttp.ConnectionTimeoutError):
+                    self.release(backend, timed_out=True)
+                    raise
+                self.release(backend, error=e)
+                tried.append(backend)
+                if last_attempt:
+                    raise
+                logger.warning(f"backend {backend.url} failed on attempt {attempt}: {e}")
+                delay = self.retry.backoff(attempt) if len(tried) >= len(self.backends) else 0.0
+            else:
+                # latency to the response headers tracks how busy the backend is
+                self.observe_latency(backend, time.monotonic() - started)
+                if response.status not in self.retry.retry_statuses or last_attempt:
+                    return backend, response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None and retry_after > self.retry.max_retry_after:
+                    return backend, response
+                response.release()
+                # busy but alive: only the answer the caller gets back may count against the breaker
+                self.release(backend)
+                tried.append(backend)
+                delay = retry_after if retry_after is not None else self.retry.backoff(attempt)
+                logger.warning(f"backend {backend.url} answered {response.status}, retrying in {delay:.1f}s")
+            if time.monotonic() + delay >= deadline:
+                raise asyncio.TimeoutError(f"request budget of {budget:.0f}s spent after {attempt} attempts")
+            await asyncio.sleep(delay)
+
+    async def fetch_models(self, session, backend) -> list:
+        """GET /v1/models from one backend, returning the model entries"""
+        timeout = aiohttp.ClientTimeout(total=self.probe_timeout)
+        async with session.get(f"{backend.url}/models", timeout=timeout) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status, message=await response.text())
+            data = await response.json()
+        models = data.get("data", [])
+        backend.listed_models = [model.get("id") for model in models]
+        return models
+
+    async def probe(self, session, backend):
+        """Fetch the models of backend, recording its health. Returns the entries, or None on failure"""
+        try:
+            models = await self.fetch_models(session, backend)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._record_failure(backend, e)
+            return None
+        self._record_success(backend)
+        return models
+
+    def add_probe_listener(self, listener):
+        """listener([(backend, model entries or None), ...]) is called after every probe round"""
+        self._probe_listeners.append(listener)
+
+    async def probe_all(self, session) -> list:
+        results = await asyncio.gather(*(self.probe(session, backend) for backend in self.backends))
+        probed = list(zip(self.backends, results))
+        for listener in self._probe_listeners:
+            listener(probed)
+        return probed
+
+    async def _probe_loop(self, session):
+        while True:
+            await self.probe_all(session)
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self, session):
+        if self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_loop(session))
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+
+def from_config(model_env: dict) -> BackendRouter:
+    """Build the router from 'backends' in model_env, or the single legacy 'llm_url'"""
+    entries = model_env.get('backends') or [{"url": model_env['llm_url']}]
+    routing = model_env.get('routing', {})
+    backends = [
+        Backend(entry['url'], entry.get('models'), CircuitBreaker(
+            failure_threshold=routing.get('failure_threshold', 2),
+            reset_timeout=routing.get('reset_timeout', 30),
+        ))
+        for entry in entries
+    ]
+    client = model_env.get('llm_client', {})
+    retry = RetryPolicy(
+        connect_timeout=client.get('connect_timeout', 10),
+        read_timeout=client.get('read_timeout', 300),
+        max_attempts=client.get('max_attempts', 4),
+        backoff_base=client.get('backoff_base', 0.5),
+        backoff_max=client.get('backoff_max', 20),
+        max_retry_after=client.get('max_retry_after', 60),
+        retry_statuses=client.get('retry_statuses', (429, 502, 503, 504)),
+    )
+    return BackendRouter(
+        backends,
+        strategy=routing.get('strategy', 'least_outstanding'),
+        ewma_alpha=routing.get('ewma_alpha', 0.3),
+        probe_interval=routing.get('probe_interval', 30),
+        probe_timeout=routing.get('probe_timeout', 5),
+        retry=retry,
+    )
@@ -0,0 +1,115 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+logger = logging.getLogger(__name__)
+
+# set by setup_logging from the 'logging' block of model_env
+PAYLOAD_SAMPLE_RATE = 1.0
+PAYLOAD_MAX_CHARS = 4000
+
+# iterencode of a non one-shot encoder yields the JSON piece by piece, so a
+# huge payload can be cut without serializing all of it
+_PAYLOAD_ENCODER = json.JSONEncoder(default=str, ensure_ascii=False)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any exception"""
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        # QueueHandler.prepare drops exc_info; _QueueHandler keeps the text in exc_text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Formats the message on the calling thread like QueueHandler, since the
+    arguments may change once the call returns, but leaves the traceback out
+    of the message and in exc_text for the listener's formatters"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class Truncated:
+    """Defers serializing obj until the record is formatted, and stops
+    serializing once max_chars are out"""
+
+    def __init__(self, obj, max_chars: int = None):
+        self.obj = obj
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        max_chars = self.max_chars if self.max_chars is not None else PAYLOAD_MAX_CHARS
+        if isinstance(self.obj, str):
+            if max_chars and len(self.obj) > max_chars:
+                return f"{self.obj[:max_chars]}... [{len(self.obj) - max_chars} more chars]"
+            return self.obj
+        pieces = []
+        size = 0
+        for piece in _PAYLOAD_ENCODER.iterencode(self.obj):
+            pieces.append(piece)
+            size += len(piece)
+            if max_chars and size > max_chars:
+                return f"{''.join(pieces)[:max_chars]}... [truncated]"
+        return "".join(pieces)
+
+
+def log_payload(log, label: str, payload):
+    """Dump a (possibly huge) payload at DEBUG, sampled and truncated.
+    Costs one level check when DEBUG is off"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    if PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= PAYLOAD_SAMPLE_RATE:
+        return
+    log.debug("%s: %s", label, Truncated(payload))
+
+
+def setup_logging(config: dict) -> logging.handlers.QueueListener:
+    """Route every record through a queue to a listener thread that does the
+    formatting and file writes, so the event loop never blocks on disk.
+
+    The file gets JSON lines (unless 'json' is false), the console plain text.
+    Stop the returned listener on shutdown to flush what is still queued."""
+    global PAYLOAD_SAMPLE_RATE, PAYLOAD_MAX_CHARS
+    PAYLOAD_SAMPLE_RATE = config.get('payload_sample_rate', 1.0)
+    PAYLOAD_MAX_CHARS = config.get('payload_max_chars', 4000)
+
+    file_handler = logging.FileHandler(config.get('file', 'discord_bot.log'))
+    if config.get('json', True):
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.setLevel(config.get('console_level', 'INFO'))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(config.get('level', 'INFO'))
+
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
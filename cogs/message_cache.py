@@ -0,0 +1,55 @@
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCache:
+    """LRU cache of discord messages keyed by message id.
+
+    Entries are evicted once the cache holds more than max_size messages or
+    when they are older than max_age seconds."""
+
+    def __init__(self, max_size: int = 2048, max_age: float = 3600):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries = OrderedDict()  # message id -> (stored_at, message)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, message_id):
+        return self.get(message_id, count=False) is not None
+
+    def put(self, message):
+        """Insert or refresh a message"""
+        if message is None:
+            return
+        self._entries[message.id] = (time.monotonic(), message)
+        self._entries.move_to_end(message.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, message_id, count: bool = True):
+        """Return the cached message or None if it is missing or expired"""
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            stored_at, message = entry
+            if time.monotonic() - stored_at <= self.max_age:
+                self._entries.move_to_end(message_id)
+                if count:
+                    self.hits += 1
+                return message
+            del self._entries[message_id]
+        if count:
+            self.misses += 1
+        return None
+
+    def evict(self, message_id):
+        self._entries.pop(message_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
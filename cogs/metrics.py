@@ -0,0 +1,117 @@
+import contextlib
+import json
+import logging
+import time
+from collections import deque
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Summary:
+    """Count and sum of every observation plus a window of the latest ones for quantiles"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self._recent.append(value)
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self._recent)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class Metrics:
+    """In-process latency summaries of the bot's stages, keyed by name and labels"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._summaries = {}  # (name, ((label, value), ...)) -> Summary
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self._summaries[key] = Summary(self.window)
+        summary.observe(seconds)
+
+    def reset(self):
+        self._summaries.clear()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **labels):
+        """Time the body, which may contain awaits, as one observation of name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> list:
+        """[{name, labels, count, sum, max, p50, p95, p99}] sorted by name, in seconds"""
+        rows = []
+        for (name, labels), summary in sorted(self._summaries.items()):
+            quantiles = summary.quantiles()
+            rows.append({
+                "name": name,
+                "labels": dict(labels),
+                "count": summary.count,
+                "sum": summary.sum,
+                "max": summary.max,
+                **{f"p{round(q * 100)}": value for q, value in quantiles.items()},
+            })
+        return rows
+
+    def prometheus_text(self) -> str:
+        lines = []
+        declared = set()
+        for row in self.snapshot():
+            name = f"llm_disc_bot_{row['name']}_seconds"
+            if name not in declared:
+                lines.append(f"# TYPE {name} summary")
+                declared.add(name)
+            labels = [f'{k}="{v}"' for k, v in row["labels"].items()]
+            for q in QUANTILES:
+                quantile_labels = ",".join(labels + [f'quantile="{q}"'])
+                lines.append(f"{name}{{{quantile_labels}}} {row[f'p{round(q * 100)}']}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {row['sum']}")
+            lines.append(f"{name}_count{suffix} {row['count']}")
+        return "\n".join(lines) + "\n"
+
+    async def start_exporter(self, host: str = "127.0.0.1", port: int = 9464):
+        """Serve /metrics (Prometheus text) and /metrics.json. Returns the runner to clean up"""
+        async def prometheus(request):
+            return web.Response(text=self.prometheus_text(), content_type="text/plain")
+
+        async def as_json(request):
+            return web.Response(text=json.dumps(self.snapshot()), content_type="application/json")
+
+        app = web.Application()
+        app.router.add_get("/metrics", prometheus)
+        app.router.add_get("/metrics.json", as_json)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"metrics exporter listening on http://{host}:{port}/metrics")
+        return runner
+
+
+# shared by every module that records timings
+METRICS = Metrics()
+
+
+def configure(config: dict):
+    METRICS.window = config.get('window', 1024)
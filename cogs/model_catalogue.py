@@ -0,0 +1,146 @@
+import difflib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# where OpenAI-compatible servers put the context window in /v1/models entries
+# (OpenRouter/LM Studio, vLLM, llama.cpp's meta block). llama.cpp's n_ctx_train
+# is left out: it is what the model was trained with, not the server's -c
+CONTEXT_LENGTH_KEYS = ("context_length", "max_context_length", "max_model_len", "context_window")
+TOOL_CAPABILITIES = ("tools", "tool_use", "tool_calls", "function_calling")
+
+
+class ModelInfo:
+    """What is known about one model: the backends serving it and, when the
+    server reports it or model_env sets it, its context length and tool support.
+    None means unknown"""
+
+    def __init__(self, model_id: str, backends=None, context_length: int = None, supports_tools: bool = None):
+        self.id = model_id
+        self.backends = list(backends or [])
+        self.context_length = context_length
+        self.supports_tools = supports_tools
+
+    def describe(self) -> str:
+        details = []
+        if self.context_length:
+            details.append(f"{self.context_length} ctx")
+        if self.supports_tools is not None:
+            details.append("tools" if self.supports_tools else "no tools")
+        details.append(", ".join(self.backends))
+        return f"{self.id} ({'; '.join(details)})"
+
+
+def context_length_of(entry: dict):
+    for key in CONTEXT_LENGTH_KEYS:
+        if isinstance(entry.get(key), int):
+            return entry[key]
+    meta = entry.get("meta") or {}
+    if isinstance(meta.get("n_ctx"), int):
+        return meta["n_ctx"]
+    top_provider = entry.get("top_provider") or {}
+    if isinstance(top_provider.get("context_length"), int):
+        return top_provider["context_length"]
+    return None
+
+
+def supports_tools_of(entry: dict):
+    """True/False when the entry lists its capabilities, None when it does not say"""
+    listed = None
+    for key in ("capabilities", "supported_parameters"):
+        if isinstance(entry.get(key), list):
+            listed = (listed or []) + entry[key]
+    if listed is None:
+        return None
+    return any(name in listed for name in TOOL_CAPABILITIES)
+
+
+class ModelCatalogue:
+    """The models served by the router's backends, kept in memory.
+
+    Fed by the /v1/models answers of the router's background health probes,
+    so lookups and !models never wait on the network and every backend is
+    polled once per probe_interval. A backend that fails a probe keeps its last
+    known models. overrides from model_env ({model: {"context_length", "tools"}})
+    win over what servers report."""
+
+    def __init__(self, router, overrides: dict = None):
+        self.router = router
+        self.overrides = overrides or {}
+        self.models = {}  # model id -> ModelInfo
+        self.refreshed_at = None
+        self._entries = {}  # backend url -> raw /v1/models entries of its last good answer
+        router.add_probe_listener(self.update)
+
+    @property
+    def loaded(self) -> bool:
+        return self.refreshed_at is not None
+
+    async def refresh(self, session):
+        """Probe every backend now instead of waiting for the next round"""
+        await self.router.probe_all(session)
+
+    def update(self, probed: list):
+        """Take in one probe round: [(backend, model entries or None), ...]"""
+        for backend, result in probed:
+            if result is not None:
+                self._entries[backend.url] = result
+            elif backend.url in self._entries:
+                logger.warning(f"{backend.url} did not list its models ({backend.last_error}), keeping the last known ones")
+        if any(result is not None for _, result in probed):
+            self.models = self._build()
+            self.refreshed_at = time.monotonic()
+            logger.info(f"model catalogue refreshed: {len(self.models)} models")
+
+    def _build(self) -> dict:
+        models = {}
+        for url, entries in self._entries.items():
+            for entry in entries:
+                model_id = entry.get("id")
+                if not model_id:
+                    continue
+                info = models.get(model_id)
+                if info is None:
+                    info = models[model_id] = ModelInfo(model_id)
+                info.backends.append(url)
+                # backends may disagree, keep the most conservative answer
+                context_length = context_length_of(entry)
+                if context_length and (info.context_length is None or context_length < info.context_length):
+                    info.context_length = context_length
+                tools = supports_tools_of(entry)
+                if tools is not None:
+                    info.supports_tools = tools if info.supports_tools is None else info.supports_tools and tools
+        for model_id, override in self.overrides.items():
+            info = models.get(model_id)
+            if info is None:
+                continue
+            info.context_length = override.get("context_length", info.context_length)
+            info.supports_tools = override.get("tools", info.supports_tools)
+        return models
+
+    def get(self, model: str):
+        return self.models.get(model)
+
+    def check(self, model: str) -> tuple:
+        """(True, []) when model is known, or nothing is known yet to check against.
+        Otherwise (False, close matches) for a did-you-mean hint"""
+        if not self.loaded or model in self.models:
+            return True, []
+        return False, difflib.get_close_matches(model, list(self.models), n=3, cutoff=0.5)
+
+    def context_length(self, model: str):
+        info = self.models.get(model)
+        return info.context_length if info is not None else None
+
+    def supports_tools(self, model: str):
+        info = self.models.get(model)
+        return info.supports_tools if info is not None else None
+
+    def age(self) -> float:
+        return time.monotonic() - self.refreshed_at if self.loaded else None
+
+
+def from_config(router, config: dict) -> ModelCatalogue:
+    """Build the catalogue from the 'model_catalogue' block of model_env"""
+    return ModelCatalogue(router, overrides=config.get('models', {}))
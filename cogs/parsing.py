@@ -0,0 +1,42 @@
+import re
+
+# a /model/ override, as its own word so paths and urls in the message are left alone
+# (the slash is matched before the look-behind so the scan only stops at slashes)
+MODEL_OVERRIDE = re.compile(r'/(?<!\S/)([^/\s]+)/(?=\s|$)')
+
+REASONING_OPEN_TAGS = ("<thinking>", "<reasoning>", "<think>")
+REASONING_CLOSE_TAGS = ("</thinking>", "</reasoning>", "</think>")
+REASONING_CLOSE = re.compile("|".join(re.escape(tag) for tag in REASONING_CLOSE_TAGS))
+
+# the chat command invocation and a leading mention are noise to the model
+PROMPT_NOISE = re.compile(
+    r'^\s*(?:!(?:chat_history|chat_hist|history_chat)\s+\d+'  # history commands and their count
+    r'|!(?:chat|ask|ai)(?=\s|$)'
+    r'|<@!?\d+>)\s*'  # addressing the bot
+)
+
+
+def extract_model(message: str, default: str) -> tuple:
+    """Pull a /model/ override out of message. Returns (model, remaining message)"""
+    match = MODEL_OVERRIDE.search(message)
+    if match is None:
+        return default, message
+    return match.group(1), (message[:match.start()] + message[match.end():]).strip()
+
+
+def strip_reasoning(text: str) -> str:
+    """Drop everything up to the last closing reasoning tag, in one pass over text"""
+    end = 0
+    for match in REASONING_CLOSE.finditer(text):
+        end = match.end()
+    return text[end:] if end else text
+
+
+def prompt_text(content: str, strip_override: bool = False) -> str:
+    """The part of a chat message meant for the model: without the command
+    invocation, its history count or a leading mention. strip_override also
+    drops the /model/ override that extract_model takes from the message"""
+    content = PROMPT_NOISE.sub("", content)
+    if strip_override:
+        _, content = extract_model(content, None)
+    return content.strip()
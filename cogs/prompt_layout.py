@@ -0,0 +1,77 @@
+import logging
+import os
+from collections import deque
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def build_messages(system_prompt: str, history: list, user_list: str, mode: str = "stable") -> list:
+    """Lay out the system prompt, history and volatile details for a request.
+
+    "legacy" appends the user list to the system prompt, which changes the very
+    first tokens whenever the participants change. "stable" keeps the system
+    prompt byte-identical and puts the volatile details (user list, time) in
+    front of the latest user message, after everything the backend may have cached."""
+    if mode != "stable" or not history or history[-1]["role"] != "user":
+        return [
+            {"role": "system", "content": system_prompt + f" The current users are {user_list}."},
+            *history,
+        ]
+
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    latest = dict(history[-1])
+    latest["content"] = f"[The current users are {user_list}. Current time: {now}.]\n{latest['content']}"
+    return [
+        {"role": "system", "content": system_prompt},
+        *history[:-1],
+        latest,
+    ]
+
+
+PREFIX_CHUNK = 4096
+
+
+def _common_prefix_len(a: bytes, b: bytes) -> int:
+    """Length of the shared prefix of a and b, one pass of chunk compares"""
+    end = min(len(a), len(b))
+    start = 0
+    while start < end:
+        stop = min(start + PREFIX_CHUNK, end)
+        if a[start:stop] != b[start:stop]:
+            return start + len(os.path.commonprefix([a[start:stop], b[start:stop]]))
+        start = stop
+    return end
+
+
+class PrefixTracker:
+    """Estimates how much of each prompt a prefix-caching backend could reuse.
+
+    Every prompt is compared against the last `window` prompts (roughly the
+    backend's cache slots); the longest shared prefix counts as reused."""
+
+    def __init__(self, window: int = 8):
+        self._recent = deque(maxlen=window)
+        self.requests = 0
+        self.prompt_chars = 0
+        self.reused_chars = 0
+
+    def observe(self, prompt: bytes) -> float:
+        """Record an encoded request body and return the fraction of it that
+        shares a prefix with a recent one"""
+        reused = max((_common_prefix_len(prompt, prev) for prev in self._recent), default=0)
+        self._recent.append(prompt)
+
+        self.requests += 1
+        self.prompt_chars += len(prompt)
+        self.reused_chars += reused
+        return reused / len(prompt) if prompt else 0.0
+
+    def stats(self) -> dict:
+        ratio = self.reused_chars / self.prompt_chars if self.prompt_chars else 0.0
+        return {
+            "requests": self.requests,
+            "prompt_chars": self.prompt_chars,
+            "reused_chars": self.reused_chars,
+            "reuse_ratio": ratio,
+        }
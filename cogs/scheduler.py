@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import logging
+from collections import Counter, OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """Raised to a queued request whose triggering message went away"""
+
+
+class Ticket:
+    def __init__(self, key, user_id, channel_id, on_position=None):
+        self.key = key
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.on_position = on_position
+        self.position = None
+        self.granted = asyncio.get_running_loop().create_future()
+        self.task = asyncio.current_task()
+        self.cancelled = False
+
+
+class RequestScheduler:
+    """Bounds how many LLM requests run at once and queues the rest fairly.
+
+    Waiting requests are kept in one queue per user and served round robin, so
+    a single user cannot starve everyone else: the user served longest ago (or
+    never) goes first, even if their queue emptied in between. A request only
+    starts while the global, per-user and per-channel running counts are under
+    their limits."""
+
+    # how many users' last service to remember before forgetting idle ones
+    MAX_REMEMBERED_USERS = 1024
+
+    def __init__(self, max_concurrent: int = 2, per_user: int = 1, per_channel: int = 2):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.per_channel = per_channel
+        self._running = {}  # key -> ticket
+        self._user_running = Counter()
+        self._channel_running = Counter()
+        self._queues = OrderedDict()  # user id -> deque of waiting tickets, in arrival order
+        self._last_served = {}  # user id -> number of the grant they last got
+        self._grants = 0
+        self._notify_tasks = set()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key, user_id, channel_id, on_position=None):
+        """Wait for a free slot, run the body, then hand the slot to the next request.
+
+        on_position is awaited with the 1-based queue position while waiting."""
+        ticket = Ticket(key, user_id, channel_id, on_position)
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if self._running.get(ticket.key) is ticket:
+                # granted just before the cancellation landed
+                self._release(ticket)
+            else:
+                self._remove_waiting(ticket)
+                self._dispatch()
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def cancel(self, key) -> bool:
+        """Cancel the queued or running request started by key. Returns whether one was found"""
+        ticket = self._running.get(key)
+        if ticket is not None:
+            ticket.cancelled = True
+            ticket.task.cancel()
+            return True
+        for queue in self._queues.values():
+            for ticket in queue:
+                if ticket.key == key:
+                    ticket.cancelled = True
+                    self._remove_waiting(ticket)
+                    ticket.granted.set_exception(RequestCancelled(key))
+                    self._dispatch()
+                    return True
+        return False
+
+    def _can_run(self, ticket) -> bool:
+        return (len(self._running) < self.max_concurrent
+                and self._user_running[ticket.user_id] < self.per_user
+                and self._channel_running[ticket.channel_id] < self.per_channel)
+
+    def _round_robin(self) -> list:
+        """Waiting users, the one served longest ago first (sorted is stable, so
+        users never served keep their arrival order)"""
+        return sorted(self._queues, key=lambda user_id: self._last_served.get(user_id, 0))
+
+    def _dispatch(self):
+        progress = True
+        while progress and len(self._running) < self.max_concurrent:
+            progress = False
+            for user_id in self._round_robin():
+                queue = self._queues[user_id]
+                ticket = queue[0]
+                if not self._can_run(ticket):
+                    continue
+                queue.popleft()
+                if not queue:
+                    del self._queues[user_id]
+                self._grants += 1
+                self._last_served[user_id] = self._grants
+                self._running[ticket.key] = ticket
+                self._user_running[ticket.user_id] += 1
+                self._channel_running[ticket.channel_id] += 1
+                ticket.granted.set_result(None)
+                progress = True
+                break
+        if len(self._last_served) > self.MAX_REMEMBERED_USERS:
+            self._forget_idle_users()
+        self._update_positions()
+
+    def _forget_idle_users(self):
+        """Drop users who wait for nothing and were served before every waiting
+        user; they would sort first on their return either way"""
+        oldest_waiting = min((self._last_served.get(user_id, 0) for user_id in self._queues), default=self._grants)
+        for user_id, served in list(self._last_served.items()):
+            if served < oldest_waiting and user_id not in self._queues:
+                del self._last_served[user_id]
+
+    def _release(self, ticket):
+        if self._running.get(ticket.key) is ticket:
+            del self._running[ticket.key]
+            self._user_running[ticket.user_id] -= 1
+            self._channel_running[ticket.channel_id] -= 1
+        self._dispatch()
+
+    def _remove_waiting(self, ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+
+    def _update_positions(self):
+        """Tell waiting requests where they are in the round robin order"""
+        queues = [list(self._queues[user_id]) for user_id in self._round_robin()]
+        total = sum(len(queue) for queue in queues)
+        order = []
+        depth = 0
+        while len(order) < total:
+            for queue in queues:
+                if depth < len(queue):
+                    order.append(queue[depth])
+            depth += 1
+
+        for position, ticket in enumerate(order, start=1):
+            if ticket.position != position and ticket.on_position is not None:
+                task = asyncio.ensure_future(ticket.on_position(position))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_done)
+            ticket.position = position
+
+    def _notify_done(self, task):
+        self._notify_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"failed to update queue position: {task.exception()}")
@@ -0,0 +1,28 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SQLiteWorker:
+    """A SQLite connection owned by one dedicated thread.
+
+    Every query runs on that thread, so the event loop never waits on disk and
+    writes are applied in the order they were queued."""
+
+    def __init__(self, path: str, schema=(), thread_name: str = "sqlite"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+        # only ever used from the executor's thread after this
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for statement in schema:
+            self._db.execute(statement)
+        self._db.commit()
+
+    async def run(self, fn, *args):
+        """Await fn(connection, *args) on the worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, self._db, *args)
+
+    def close(self):
+        # queued writes finish first
+        self._executor.submit(self._db.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+
+from cogs.parsing import REASONING_OPEN_TAGS, REASONING_CLOSE_TAGS, REASONING_CLOSE
+
+logger = logging.getLogger(__name__)
+
+MAX_TAG_LEN = max(len(tag) for tag in REASONING_CLOSE_TAGS)
+
+
+async def iter_sse(response):
+    """Yield the decoded json events of a server-sent-events response.
+    Stops at the OpenAI style `data: [DONE]` sentinel."""
+    data_lines = []
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            # a blank line terminates the current event
+            if data_lines:
+                data = "\n".join(data_lines)
+                data_lines = []
+                if data == "[DONE]":
+                    return
+                yield json.loads(data)
+            continue
+        if line.startswith(':'):
+            # comment / keepalive line
+            continue
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'data':
+            data_lines.append(value)
+
+    if data_lines and "\n".join(data_lines) != "[DONE]":
+        yield json.loads("\n".join(data_lines))
+
+
+async def read_stream(response, on_text):
+    """Consume a streamed /chat/completions response.
+
+    on_text is awaited with every content delta as it arrives.
+    Returns (finish_reason, message) shaped like the non-streamed choice."""
+    content = []
+    tool_calls = {}
+    finish_reason = None
+
+    async for event in iter_sse(response):
+        for choice in event.get("choices", []):
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                content.append(delta["content"])
+                await on_text(delta["content"])
+            # tool calls arrive in pieces, keyed by their index
+            for tc in delta.get("tool_calls") or []:
+                slot = tool_calls.setdefault(tc.get("index", 0), {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                if tc.get("id"):
+                    slot["id"] = tc["id"]
+                function = tc.get("function") or {}
+                if function.get("name"):
+                    slot["function"]["name"] += function["name"]
+                if function.get("arguments"):
+                    slot["function"]["arguments"] += function["arguments"]
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+
+    message = {"role": "assistant", "content": "".join(content)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[idx] for idx in sorted(tool_calls)]
+        if finish_reason is None:
+            finish_reason = "tool_calls"
+    return finish_reason, message
+
+
+class ReasoningFilter:
+    """Incrementally strips reasoning blocks out of streamed model output.
+
+    Mirrors the non-streamed filtering: everything up to the last closing
+    reasoning tag is dropped. Output that opens with a reasoning tag is held
+    back until the block closes so the thinking text never gets shown."""
+
+    def __init__(self):
+        self._pieces = []
+        self._tail = ""
+        self._decided = False
+        self.thinking = False
+
+    def feed(self, delta: str):
+        window = self._tail + delta
+        cut = -1
+        for match in REASONING_CLOSE.finditer(window):
+            # only count tags that end inside the new delta, older ones were already handled
+            if match.end() > len(self._tail):
+                cut = match.end()
+
+        if cut != -1:
+            self._pieces = [window[cut:]]
+            self._decided = True
+            self.thinking = False
+        else:
+            self._pieces.append(delta)
+        self._tail = window[-(MAX_TAG_LEN - 1):]
+
+        if not self._decided:
+            head = "".join(self._pieces).lstrip()
+            if any(head.startswith(tag) for tag in REASONING_OPEN_TAGS):
+                self._decided = True
+                self.thinking = True
+            elif head and not any(tag.startswith(head) for tag in REASONING_OPEN_TAGS):
+                self._decided = True
+
+    def text(self) -> str:
+        """The currently visible part of the answer"""
+        if self.thinking or not self._decided:
+            return ""
+        return "".join(self._pieces)
+
+
+class StreamingReply:
+    """Renders a streamed answer into the placeholder message and follow up replies.
+
+    Edits are coalesced: at most one round of edits goes out per edit_interval
+    seconds, which keeps us well inside Discord's message edit rate limits.
+    delivery (a cogs.delivery.Delivery) decides how the text is laid out."""
+
+    def __init__(self, placeholder, delivery, edit_interval: float = 1.0):
+        self.messages = [placeholder]
+        self.rendered = [(placeholder.content, False)]
+        self.delivery = delivery
+        self.edit_interval = edit_interval
+        self.filter = ReasoningFilter()
+        self._last_flush = 0.0
+
+    async def feed(self, delta: str):
+        """on_text callback for read_stream"""
+        self.filter.feed(delta)
+        now = asyncio.get_running_loop().time()
+        if now - self._last_flush >= self.edit_interval:
+            self._last_flush = now
+            await self.flush()
+
+    async def finish(self, ai_response: str):
+        """Render the final answer, replacing whatever was streamed so far"""
+        self.filter = ReasoningFilter()
+        self.filter.feed(ai_response)
+        if not self.filter.text().strip():
+            self.filter = ReasoningFilter()
+            self.filter.feed("No response from AI")
+        await self.flush()
+        text = self.filter.text()
+        if self.delivery.wants_file(text):
+            self.messages[0] = await self.messages[0].edit(**self.delivery.file_kwargs(text))
+
+    async def flush(self):
+        text = self.filter.text()
+        if not text.strip():
+            return
+
+        layout = self.delivery.layout(text)
+        for idx, part in enumerate(layout):
+            if idx < len(self.messages):
+                if self.rendered[idx] != part:
+                    # discord.py returns the edited message as a new object
+                    self.messages[idx] = await self.messages[idx].edit(**self.delivery.message_kwargs(*part))
+                    self.rendered[idx] = part
+            else:
+                # chain new chunks as replies to the previous one
+                new_msg = await self.messages[-1].reply(**self.delivery.message_kwargs(*part))
+                self.messages.append(new_msg)
+                self.rendered.append(part)
+
+        # the visible text can shrink when a late closing tag shows up
+        while len(self.messages) > len(layout):
+            stale = self.messages.pop()
+            self.rendered.pop()
+            await stale.delete()
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$')
+
+
+class DependencyBuildError(Exception):
+    """pip could not install the requested dependency set"""
+
+
+def normalize_requirements(dependencies: list) -> list:
+    """Canonical, sorted, de-duplicated requirement strings (PEP 503 names, no spaces)"""
+    normalized = set()
+    for dependency in dependencies:
+        match = REQUIREMENT_PATTERN.match(dependency.strip())
+        if not match:
+            raise DependencyBuildError(f"invalid requirement: {dependency!r}")
+        name, rest = match.groups()
+        normalized.add(re.sub(r'[-_.]+', '-', name).lower() + rest.replace(" ", ""))
+    return sorted(normalized)
+
+
+def _is_read_timeout(error: Exception) -> bool:
+    """docker's wait(timeout=...) gives up with ReadTimeout, or over the unix
+    socket with a ConnectionError wrapping urllib3's ReadTimeoutError"""
+    if isinstance(error, requests.exceptions.ReadTimeout):
+        return True
+    return (isinstance(error, requests.exceptions.ConnectionError)
+            and any(isinstance(arg, urllib3.exceptions.ReadTimeoutError) for arg in error.args))
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class DependencyCache:
+    """Content addressed cache of pip --target layers, mounted read-only into the sandboxes.
+
+    A layer is keyed by the sandbox image plus the normalized requirement set,
+    built once in a throwaway container and reused by every later run asking
+    for the same set. Least recently used layers are deleted once the cache
+    grows past max_bytes. With wheel_dir (or a local index_url) layers build
+    without network access. At most max_builds layers build at once, on
+    threads of their own so builds never hold up the pool's docker calls."""
+
+    def __init__(self, dir: str, image: str, max_bytes: int = 5_000_000_000, wheel_dir: str = None,
+                 index_url: str = None, network_mode: str = "bridge", build_timeout: float = 300,
+                 max_builds: int = 2):
+        self.dir = os.path.abspath(dir)
+        self.image = image
+        self.max_bytes = max_bytes
+        self.wheel_dir = os.path.abspath(wheel_dir) if wheel_dir else None
+        self.index_url = index_url
+        # nothing to download when installing from the wheel directory
+        self.network_mode = "none" if self.wheel_dir else network_mode
+        self.build_timeout = build_timeout
+        self._client = None
+        self._call = None
+        self._building = {}  # key -> future of an in-flight build
+        self._build_executor = ThreadPoolExecutor(max_workers=max_builds, thread_name_prefix="dep-build")
+        self._pins = {}  # key -> number of runs using the layer
+        self._index_path = os.path.join(self.dir, "index.json")
+        self._index = {}
+
+    def bind(self, client, call):
+        """Hand over the docker client and the executor runner of the owning pool.
+        The cache directory is created (and its index read) only now, when the pool starts"""
+        self._client = client
+        self._call = call
+        os.makedirs(self.dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # forget entries whose directory went missing
+        return {key: entry for key, entry in index.items() if os.path.isdir(os.path.join(self.dir, key))}
+
+    def _save_index(self, index: dict):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def key_for(self, requirements: list) -> str:
+        digest = hashlib.sha256("\n".join([self.image, *requirements]).encode()).hexdigest()
+        return digest[:32]
+
+    async def acquire(self, dependencies: list) -> str:
+        """Return the key of a layer holding dependencies, building it if needed.
+        The layer is pinned against eviction until release(key)"""
+        requirements = normalize_requirements(dependencies)
+        key = self.key_for(requirements)
+        self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            if key in self._index:
+                logger.info(f"dependency layer hit for {requirements}")
+            else:
+                # concurrent requests for the same set share one build
+                if key not in self._building:
+                    self._building[key] = asyncio.ensure_future(self._build_layer(key, requirements))
+                await asyncio.shield(self._building[key])
+        except BaseException:
+            self.release(key)
+            raise
+        self._index[key]["last_used"] = time.time()
+        return key
+
+    def release(self, key: str):
+        self._pins[key] -= 1
+        if not self._pins[key]:
+            del self._pins[key]
+
+    async def _build_layer(self, key: str, requirements: list):
+        started = time.monotonic()
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(
+                self._build_executor, self._build, key, requirements)
+        finally:
+            del self._building[key]
+        self._index[key] = {"requirements": requirements, "size": size, "last_used": time.time()}
+        logger.info(f"built dependency layer {key} for {requirements} ({size} bytes) in {time.monotonic() - started:.1f}s")
+        await self._evict()
+
+    def close(self):
+        self._build_executor.shutdown(wait=False)
+
+    def _build(self, key: str, requirements: list) -> int:
+        """Blocking: pip install requirements into <dir>/<key> from a throwaway container"""
+        build_dir = os.path.join(self.dir, f".build-{key}")
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+        pip_args = ["pip", "install", "--quiet", "--no-cache-dir", "--target", f"/cache/.build-{key}"]
+        volumes = {self.dir: {"bind": "/cache", "mode": "rw"}}
+        if self.wheel_dir:
+            pip_args += ["--no-index", "--find-links", "/wheels"]
+            volumes[self.wheel_dir] = {"bind": "/wheels", "mode": "ro"}
+        elif self.index_url:
+            pip_args += ["--index-url", self.index_url]
+
+        container = self._client.containers.run(
+            self.image,
+            command=pip_args + requirements,
+            volumes=volumes,
+            # build as the bot's own user so it can delete the layer later
+            user=f"{os.getuid()}:{os.getgid()}",
+            environment={"HOME": "/tmp", "PIP_DISABLE_PIP_VERSION_CHECK": "1"},
+            network_mode=self.network_mode,
+            detach=True,
+        )
+        try:
+            try:
+                status = container.wait(timeout=self.build_timeout)
+            except requests.exceptions.RequestException as e:
+                if not _is_read_timeout(e):
+                    raise
+                container.kill()
+                raise DependencyBuildError(f"installing {' '.join(requirements)} took longer than {self.build_timeout}s")
+            if status.get("StatusCode") != 0:
+                logs = container.logs(stdout=False, stderr=True).decode('utf-8', errors='replace')
+                raise DependencyBuildError(f"pip install {' '.join(requirements)} failed:\n{logs}")
+        finally:
+            container.remove(force=True)
+
+        # a leftover from an unindexed earlier build would make the rename fail
+        shutil.rmtree(os.path.join(self.dir, key), ignore_errors=True)
+        os.replace(build_dir, os.path.join(self.dir, key))
+        return _dir_size(os.path.join(self.dir, key))
+
+    async def _evict(self):
+        """Delete least recently used, unpinned layers until the cache is under max_bytes"""
+        total = sum(entry["size"] for entry in self._index.values())
+        victims = []
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            victims.append(key)
+            total -= entry["size"]
+        # drop them from the index before touching the disk so no run can pick them up
+        for key in victims:
+            logger.info(f"evicting dependency layer {key} ({self._index[key]['size']} bytes)")
+            del self._index[key]
+        for key in victims:
+            await self._call(shutil.rmtree, os.path.join(self.dir, key), True)
+        await self._call(self._save_index, dict(self._index))
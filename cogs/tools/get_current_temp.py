@@ -1,18 +1,94 @@
 import python_weather
 
 import asyncio
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# one client for every lookup, opened on first use (it needs a running loop)
+CLIENT = None
+# normalized location -> (fetched at, temperature)
+CACHE = {}
+# normalized location -> future of the upstream request in flight
+IN_FLIGHT = {}
+STATS = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "errors": 0}
+# fresh entries are answered from the cache; stale ones only when the upstream fails
+TTL = 600
+STALE_TTL = 3600
+MAX_ENTRIES = 1024
+
+def configure(config: dict):
+  """Set the cache lifetimes from the tool's block in model_env"""
+  global TTL, STALE_TTL, MAX_ENTRIES
+  TTL = config.get("ttl", TTL)
+  STALE_TTL = config.get("stale_ttl", STALE_TTL)
+  MAX_ENTRIES = config.get("max_entries", MAX_ENTRIES)
+
+async def close():
+  global CLIENT
+  if CLIENT is not None:
+    await CLIENT.close()
+    CLIENT = None
+
+def stats() -> dict:
+  return {**STATS, "entries": len(CACHE)}
+
+def normalize_location(location: str) -> str:
+  """'  austin ,TX,  USA ' and 'Austin, TX, USA' share a cache entry"""
+  return re.sub(r'\s*,\s*', ', ', re.sub(r'\s+', ' ', location.strip())).lower()
 
 async def call_api(location) -> str:
+  global CLIENT
   # Declare the client. The measuring unit used defaults to the metric system (celcius, km/h, etc.)
-  async with python_weather.Client(unit=python_weather.IMPERIAL) as client:
-    
-    # Fetch a weather forecast from a city.
-    weather = await client.get(location)
-    
-    # Fetch the temperature for today.
-    return str(weather.temperature)
-    
+  if CLIENT is None:
+    CLIENT = python_weather.Client(unit=python_weather.IMPERIAL)
+
+  # Fetch a weather forecast from a city.
+  weather = await CLIENT.get(location)
+
+  # Fetch the temperature for today.
+  return str(weather.temperature)
+
+async def _refresh(key: str) -> str:
+  try:
+    temperature = await call_api(key)
+  finally:
+    del IN_FLIGHT[key]
+  CACHE.pop(key, None)
+  CACHE[key] = (time.monotonic(), temperature)
+  # dicts keep insertion order, so the first entries are the oldest fetches
+  while len(CACHE) > MAX_ENTRIES:
+    del CACHE[next(iter(CACHE))]
+  return temperature
+
+async def get_temperature(location: str) -> str:
+  """Cached, coalesced lookup; serves a stale entry if the upstream is failing"""
+  key = normalize_location(location)
+  entry = CACHE.get(key)
+  if entry is not None and time.monotonic() - entry[0] < TTL:
+    STATS["hits"] += 1
+    return entry[1]
+
+  if key in IN_FLIGHT:
+    STATS["coalesced"] += 1
+  else:
+    STATS["misses"] += 1
+    IN_FLIGHT[key] = asyncio.ensure_future(_refresh(key))
+  try:
+    # shielded so one caller giving up does not cancel the lookup for the others
+    return await asyncio.shield(IN_FLIGHT[key])
+  except asyncio.CancelledError:
+    raise
+  except Exception as e:
+    STATS["errors"] += 1
+    if entry is not None and time.monotonic() - entry[0] < STALE_TTL:
+      STATS["stale"] += 1
+      logger.warning(f"weather lookup for {key!r} failed ({e}), serving cached value")
+      return entry[1]
+    raise
+
 async def call_tool(location: str) -> str:
-    res = await call_api(location)
+    res = await get_temperature(location)
     return [("tempurature", res)]
-
@@ -1,107 +1,101 @@
 import docker
-import tempfile
-import os
-import subprocess
-from typing import Optional
 import logging
-import sys
 import asyncio
+import re
+
+from cogs.tools.sandbox_pool import SandboxPool
+from cogs.log_setup import log_payload
 
 logger = logging.getLogger(__name__)
-handler = logging.StreamHandler(stream=sys.stdout)
-formatter = logging.Formatter('[%(levelname)s] %(message)s')
-handler.setFormatter(formatter)
-handler.setLevel(logging.DEBUG)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
-
-async def call_tool(user_code: str, 
-              dependencies: str, 
-              language: str = "python",
-              docker_image: str = "python:3.11-slim",
-              work_dir: Optional[str] = None) -> dict:
+
+# warm sandbox containers shared by every call, see configure()
+POOL = SandboxPool()
+# rough budget for what goes back into the prompt, at ~4 characters per token
+MAX_RESULT_TOKENS = 2000
+CHARS_PER_TOKEN = 4
+
+def configure(config: dict):
+    """Set up the sandbox pool from the tool's block in model_env"""
+    global POOL, MAX_RESULT_TOKENS
+    config = dict(config)
+    MAX_RESULT_TOKENS = config.pop("max_result_tokens", MAX_RESULT_TOKENS)
+    POOL = SandboxPool(**config)
+
+async def close():
+    await POOL.close()
+
+# anything that can make two runs of the same program print different things:
+# clocks, randomness, the network, the file system, the environment, object
+# identities and dynamic code that could reach any of those
+NONDETERMINISTIC = re.compile(
+    r'\b(random|rand\w*|sample|shuffle|secrets|uuid|time|datetime|socket|urllib|requests|httpx|aiohttp|http'
+    r'|subprocess|os|sys|io|pathlib|shutil|glob|tempfile|platform|input|open'
+    r'|importlib|__import__|exec|eval|compile|builtins|globals|id|hash)\b')
+# default object reprs carry memory addresses, which change from run to run
+OBJECT_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+def cache_key(user_code: str, dependencies: str = "", language: str = "python"):
+    """Result cache key for a run, or None when the program may not be deterministic"""
+    if NONDETERMINISTIC.search(user_code):
+        return None
+    return [user_code, sorted(dependencies.replace(",", " ").split()) if dependencies else [], language.lower()]
+
+def cacheable_result(result: list) -> bool:
+    """Only clean runs are worth repeating; timeouts and crashes may be transient"""
+    result = dict(result)
+    return result.get("exit_code") == 0 and not OBJECT_ADDRESS.search(result.get("stdout", ""))
+
+def _truncate(text: str, max_chars: int) -> str:
+    """Keep the start and end of text, dropping the middle"""
+    if len(text) <= max_chars:
+        return text
+    head = max_chars // 2
+    tail = max_chars - head
+    return f"{text[:head]}\n... [{len(text) - max_chars} characters truncated] ...\n{text[-tail:]}"
+
+async def call_tool(user_code: str,
+              dependencies: str,
+              language: str = "python") -> list:
     """
-    Writes user code to disk and runs it in a Docker container.
-    
+    Runs the user's program in a warm, locked down sandbox container.
+
     Args:
         user_code: The user's program as a string
-        language: Programming language (used for file extension)
-        docker_image: Docker image to use for execution
-        timeout: Maximum execution time in seconds
-        work_dir: Optional working directory for the container
-    
+        dependencies: Comma separated pip packages to install first
+        language: Programming language, only python is supported
+
     Returns:
-        dict with 'stdout', 'stderr', 'return_code'
+        list of (name, value) result pairs: stdout, stderr, exit_code and runtime_s
     """
-    # Create a temporary file for the code
-    file_extension = ".py" if language.lower() == "python" else f".{language}"
-    
-    with tempfile.NamedTemporaryFile(mode='w', suffix=file_extension, delete=False) as temp_file:
-        temp_file.write(user_code)
-        temp_file_path = temp_file.name
-        temp_dir = os.path.dirname(temp_file_path)
-        temp_filename = os.path.basename(temp_file_path)
-
-    logger.info(f"wrote user code to: {temp_file_path}")
-    dep_list = dependencies.replace(",", " ")
+    if language.lower() != "python":
+        return [("stderr", f"unsupported language: {language}")]
+
+    dep_list = dependencies.replace(",", " ").split() if dependencies else []
 
     try:
-        # Initialize Docker client
-        client = docker.from_env()
-
-        cmd_str = f"python /app/{temp_filename}"
-        if dep_list:
-            cmd_str = f"pip install {dep_list} && " + cmd_str
-        
-        # Create container
-        container = client.containers.run(
-            docker_image,
-            command=f'/bin/bash -c "{cmd_str}"',
-            volumes={temp_dir: {'bind': '/app', 'mode': 'ro'}},
-            working_dir='/app',
-            network_mode = "host",
-            remove=True,
-            detach=False,
-            stdout=True,
-            stderr=True,
-            mem_limit='4g',      # Security: limit memory
-            cpu_quota=20000,       # Security: limit CPU usage
-        )
-
-        # Parse output
-        output = container.decode('utf-8')
-        lines = output.strip()
-        logger.info(f"raw output from container: {lines}")
-
-        return [("stdout:", lines)]
-
-    except docker.errors.ContainerError as e:
-        return [("stderr:", e.stderr.decode('utf-8'))]
-
-    except docker.errors.NotFound:
-        return {
-            'stdout': '',
-            'stderr': f'Docker image {docker_image} not found',
-            'return_code': 1
-        }
+        result = await POOL.run(user_code, dep_list)
+    except docker.errors.ImageNotFound:
+        return [("stderr", f'Docker image {POOL.image} not found')]
     except docker.errors.APIError as e:
-        return {
-            'stdout': '',
-            'stderr': f'Docker API error: {str(e)}',
-            'return_code': 1
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            'stdout': '',
-            'stderr': f'Execution timeout after {timeout} seconds',
-            'return_code': 124
-        }
-    finally:
-        # Clean up temporary file
-        try:
-            os.unlink(temp_file_path)
-        except OSError:
-            pass
+        return [("stderr", f'Docker API error: {str(e)}')]
+
+    stdout = result["stdout"].strip()
+    stderr = result["stderr"].strip()
+    logger.info(f"sandbox exited with {result['exit_code']} after {result['runtime']:.2f}s, "
+                f"{result['output_bytes']} output bytes")
+    log_payload(logger, "sandbox stdout", stdout)
+    log_payload(logger, "sandbox stderr", stderr)
+
+    # stdout gets most of the budget, error output is usually short
+    budget = MAX_RESULT_TOKENS * CHARS_PER_TOKEN
+    stderr = _truncate(stderr, budget // 4)
+    stdout = _truncate(stdout, budget - len(stderr))
+    return [
+        ("stdout", stdout),
+        ("stderr", stderr),
+        ("exit_code", result["exit_code"]),
+        ("runtime_s", round(result["runtime"], 3)),
+    ]
 
 # Example usage
 if __name__ == "__main__":
@@ -110,6 +104,10 @@ print("Hello from Docker!")
 x = 5 + 3
 print(f"Calculation: {x}")
 """
-    
-    result = asyncio.run(call_tool(sample_code))
-    print(f"STDOUT: {result}")
+
+    async def main():
+        result = await call_tool(sample_code, "")
+        print(f"STDOUT: {result}")
+        await close()
+
+    asyncio.run(main())
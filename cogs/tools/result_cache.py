@@ -0,0 +1,87 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from cogs.sqlite_worker import SQLiteWorker
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """LRU cache of tool results with a per-entry ttl.
+
+    Results live in memory; with a path they are also written through to a
+    SQLite file, so they survive a restart and the memory tier can stay small.
+    The SQLite queries run on a SQLiteWorker, off the event loop.
+    Results must be JSON serializable lists of (name, value) pairs."""
+
+    def __init__(self, max_entries: int = 512, path: str = None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._db = None
+        if path:
+            self._db = SQLiteWorker(path, (
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                " key TEXT PRIMARY KEY,"
+                " expires_at REAL NOT NULL,"
+                " result TEXT NOT NULL)",
+            ), thread_name="tool-cache")
+            logger.info(f"tool result cache opened at {path}")
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        """Return the cached result or None if it is missing or expired"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        if self._db is not None:
+            row = await self._db.run(self._select, key, now)
+            if row is not None:
+                result = [tuple(pair) for pair in json.loads(row[1])]
+                self._remember(key, row[0], result)
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def _select(self, db, key: str, now: float):
+        return db.execute(
+            "SELECT expires_at, result FROM tool_results WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+
+    async def put(self, key: str, result, ttl: float):
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, result)
+        if self._db is not None:
+            await self._db.run(self._write, key, expires_at, json.dumps(result))
+
+    def _write(self, db, key: str, expires_at: float, blob: str):
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO tool_results (key, expires_at, result) VALUES (?, ?, ?)",
+                (key, expires_at, blob),
+            )
+            db.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key, expires_at, result):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self._entries.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+
+from cogs.tools.dep_cache import DependencyCache, DependencyBuildError
+
+logger = logging.getLogger(__name__)
+
+# uid/gid of `nobody`; user code never runs as root
+SANDBOX_USER = "65534:65534"
+SANDBOX_ENV = {
+    "HOME": "/sandbox",
+    "PYTHONPATH": "/sandbox/deps",
+    "PYTHONDONTWRITEBYTECODE": "1",
+    # fixed str/bytes hashing, so set and dict orders repeat between runs (and cached results stay true)
+    "PYTHONHASHSEED": "0",
+    "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+    "PIP_NO_CACHE_DIR": "1",
+}
+
+
+class CappedOutput:
+    """Keeps the first head_bytes and last tail_bytes of a byte stream, counting the rest"""
+
+    def __init__(self, head_bytes: int, tail_bytes: int):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, chunk: bytes):
+        self.total += len(chunk)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk and self.tail_bytes:
+            self.tail += chunk
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def truncated(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode('utf-8', errors='replace')
+        if not self.tail:
+            return head
+        tail = self.tail.decode('utf-8', errors='replace')
+        if self.truncated:
+            return f"{head}\n... [{self.truncated} bytes truncated] ...\n{tail}"
+        return head + tail
+
+
+class Sandbox:
+    """A long running, locked down container that user programs are exec'd into"""
+
+    def __init__(self, container, head_bytes: int = 16384, tail_bytes: int = 16384,
+                 max_output_bytes: int = 1_000_000):
+        self.container = container
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.max_output_bytes = max_output_bytes
+        self.runs = 0
+        self.last_used = time.monotonic()
+
+    def _exec(self, cmd: list, environment: dict) -> dict:
+        """Run cmd, streaming its output into capped buffers. A process that writes
+        more than max_output_bytes in total gets its container killed"""
+        api = self.container.client.api
+        exec_id = api.exec_create(
+            self.container.id, cmd, user=SANDBOX_USER, environment=environment, workdir="/sandbox")["Id"]
+        stdout = CappedOutput(self.head_bytes, self.tail_bytes)
+        stderr = CappedOutput(self.head_bytes, self.tail_bytes)
+        killed = False
+        started = time.monotonic()
+        for out_chunk, err_chunk in api.exec_start(exec_id, stream=True, demux=True):
+            if out_chunk:
+                stdout.write(out_chunk)
+            if err_chunk:
+                stderr.write(err_chunk)
+            if stdout.total + stderr.total > self.max_output_bytes:
+                logger.error(f"sandbox {self.container.short_id} passed {self.max_output_bytes} output bytes, killing it")
+                self.kill()
+                killed = True
+                break
+        runtime = time.monotonic() - started
+
+        exit_code = api.exec_inspect(exec_id).get("ExitCode")
+        if killed or exit_code is None:
+            exit_code = 137
+        return {
+            "exit_code": exit_code,
+            "stdout": stdout.text(),
+            "stderr": stderr.text() + (f"\n[output limit of {self.max_output_bytes} bytes reached, process killed]" if killed else ""),
+            "runtime": runtime,
+            "output_bytes": stdout.total + stderr.total,
+        }
+
+    def run(self, user_code: str, dependencies: list, deps_path: str = None) -> dict:
+        """Install dependencies and run user_code. Returns a dict with exit_code, stdout,
+        stderr, runtime and output_bytes. With deps_path the dependencies come prebuilt
+        from the layer cache instead"""
+        self.runs += 1
+        environment = SANDBOX_ENV
+        if deps_path:
+            environment = {**SANDBOX_ENV, "PYTHONPATH": deps_path}
+        elif dependencies:
+            result = self._exec(["pip", "install", "--quiet", "--target", "/sandbox/deps", *dependencies], SANDBOX_ENV)
+            if result["exit_code"] != 0:
+                return result
+
+        return self._exec(["python", "-c", user_code], environment)
+
+    def reset(self):
+        """Wipe everything the last run left behind"""
+        # kill every leftover process of the sandbox user first (including this
+        # exec's shell), so nothing can write new files after the wipe
+        self.container.exec_run(["sh", "-c", "kill -9 -1"], user=SANDBOX_USER)
+        exit_code, _ = self.container.exec_run(
+            ["sh", "-c", "rm -rf /sandbox/* /sandbox/.[!.]* /tmp/*"], user=SANDBOX_USER)
+        if exit_code != 0:
+            raise RuntimeError(f"sandbox reset failed with {exit_code}")
+        self.last_used = time.monotonic()
+
+    def kill(self):
+        """Stop whatever is running right now; unblocks a pending exec"""
+        try:
+            self.container.kill()
+        except docker.errors.APIError as e:
+            logger.error(f"failed to kill sandbox {self.container.short_id}: {e}")
+
+    def destroy(self):
+        try:
+            self.container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.error(f"failed to remove sandbox {self.container.short_id}: {e}")
+
+
+class SandboxPool:
+    """Pool of pre-started sandbox containers.
+
+    At most `size` programs run at once. `warm` containers are started ahead
+    of time and kept around; extra idle ones are reaped after idle_timeout
+    seconds. A container is recycled after max_runs programs or after any error,
+    and a replacement is started in the background so the next program still
+    finds a warm one.
+
+    The docker SDK is blocking, so every docker call runs on a small dedicated
+    thread pool and the event loop stays free. A program still running after
+    `timeout` seconds gets its container killed.
+
+    With a dependency_cache config, dependency sets are installed once into
+    a shared layer cache mounted read-only at /deps-cache instead of being
+    pip installed on every run."""
+
+    def __init__(self, image: str = "python:3.11-slim", size: int = 4, warm: int = 2, max_runs: int = 20,
+                 idle_timeout: float = 300, timeout: float = 60, mem_limit: str = "1g", cpu_quota: int = 20000,
+                 pids_limit: int = 128, network_mode: str = "bridge", dependency_cache: dict = None,
+                 capture_head_bytes: int = 16384, capture_tail_bytes: int = 16384, max_output_bytes: int = 1_000_000):
+        self.image = image
+        self.size = size
+        self.warm = min(warm, size)
+        self.max_runs = max_runs
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.capture_limits = {
+            "head_bytes": capture_head_bytes,
+            "tail_bytes": capture_tail_bytes,
+            "max_output_bytes": max_output_bytes,
+        }
+        self.container_options = {
+            "mem_limit": mem_limit,
+            "cpu_quota": cpu_quota,
+            "pids_limit": pids_limit,
+            "network_mode": network_mode,
+        }
+        self.deps = None
+        if dependency_cache:
+            self.deps = DependencyCache(image=image, network_mode=network_mode, **dependency_cache)
+        self._client = None
+        self._idle = []
+        self._busy = 0
+        self._spares = set()  # background starts of replacement containers
+        self._slots = None
+        self._started = None
+        self._reaper = None
+        # one thread per running program plus spares so kills and starts never queue behind them
+        # (dependency builds run on the cache's own threads)
+        self._executor = ThreadPoolExecutor(max_workers=size + 2, thread_name_prefix="sandbox")
+
+    async def _call(self, fn, *args):
+        """Run a blocking docker call on the pool's threads"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _start_container(self) -> Sandbox:
+        volumes = {}
+        if self.deps is not None:
+            volumes[self.deps.dir] = {"bind": "/deps-cache", "mode": "ro"}
+        container = self._client.containers.run(
+            self.image,
+            command=["sleep", "infinity"],
+            detach=True,
+            auto_remove=False,
+            read_only=True,
+            tmpfs={
+                "/sandbox": "rw,exec,size=1g,uid=65534,gid=65534,mode=0700",
+                "/tmp": "rw,exec,size=256m,mode=1777",
+            },
+            cap_drop=["ALL"],
+            security_opt=["no-new-privileges"],
+            labels={"llm_disc_bot.sandbox": "1"},
+            volumes=volumes,
+            **self.container_options,
+        )
+        logger.info(f"started sandbox container {container.short_id}")
+        return Sandbox(container, **self.capture_limits)
+
+    async def start(self):
+        """Connect to docker and pre-start the warm containers. Safe to call
+        repeatedly; after a failed start the next call tries again"""
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        started = self._started
+        try:
+            # shielded so a cancelled caller does not cancel the start others wait on
+            await asyncio.shield(started)
+        except Exception:
+            if self._started is started:
+                self._started = None
+                self._slots = None
+            raise
+
+    async def _start(self):
+        self._slots = asyncio.Semaphore(self.size)
+        self._client = await self._call(docker.from_env)
+        if self.deps is not None:
+            self.deps.bind(self._client, self._call)
+        results = await asyncio.gather(
+            *(self._call(self._start_container) for _ in range(self.warm)), return_exceptions=True)
+        sandboxes = [result for result in results if isinstance(result, Sandbox)]
+        errors = [result for result in results if not isinstance(result, Sandbox)]
+        if errors:
+            # do not leave the containers that did start behind
+            for sandbox in sandboxes:
+                await self._call(sandbox.destroy)
+            raise errors[0]
+        self._idle.extend(sandboxes)
+        self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def run(self, user_code: str, dependencies: list):
+        """Run a program in a pooled sandbox. Returns the result dict of Sandbox.run"""
+        await self.start()
+        layer = None
+        if self.deps is not None and dependencies:
+            # built (or found) before taking a sandbox, so a slow build holds no container
+            try:
+                layer = await self.deps.acquire(dependencies)
+            except DependencyBuildError as e:
+                return {"exit_code": 1, "stdout": "", "stderr": str(e), "runtime": 0.0, "output_bytes": 0}
+        try:
+            return await self._run_in_sandbox(user_code, dependencies, layer)
+        finally:
+            if layer is not None:
+                self.deps.release(layer)
+
+    async def _run_in_sandbox(self, user_code: str, dependencies: list, layer: str = None):
+        deps_path = f"/deps-cache/{layer}" if layer else None
+        async with self._slots:
+            sandbox = self._idle.pop() if self._idle else await self._call(self._start_container)
+            self._busy += 1
+            try:
+                return await self._run_checked_out(sandbox, user_code, dependencies, deps_path)
+            finally:
+                self._busy -= 1
+                self._replenish()
+
+    async def _run_checked_out(self, sandbox, user_code: str, dependencies: list, deps_path: str):
+        try:
+            result = await asyncio.wait_for(
+                self._call(sandbox.run, user_code, dependencies, deps_path), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"sandbox {sandbox.container.short_id} timed out after {self.timeout}s, killing it")
+            await self._call(sandbox.kill)
+            await self._call(sandbox.destroy)
+            return {"exit_code": 124, "stdout": "", "stderr": f"Execution timeout after {self.timeout} seconds",
+                    "runtime": self.timeout, "output_bytes": 0}
+        except asyncio.CancelledError:
+            # the exec thread keeps going until the container dies
+            await asyncio.shield(self._call(sandbox.destroy))
+            raise
+        except Exception:
+            await self._call(sandbox.destroy)
+            raise
+        await self._give_back(sandbox, result["exit_code"] == 0)
+        return result
+
+    def _replenish(self):
+        """Start containers in the background until `warm` exist again, counting
+        idle, running and starting ones"""
+        if self._started is None:
+            # closed
+            return
+        missing = self.warm - len(self._idle) - self._busy - len(self._spares)
+        for _ in range(max(missing, 0)):
+            task = asyncio.create_task(self._start_spare())
+            self._spares.add(task)
+            task.add_done_callback(self._spares.discard)
+
+    async def _start_spare(self):
+        try:
+            sandbox = await self._call(self._start_container)
+        except docker.errors.DockerException as e:
+            logger.error(f"failed to start a replacement sandbox: {e}")
+            return
+        self._idle.append(sandbox)
+
+    async def _give_back(self, sandbox, ok: bool):
+        if not ok or sandbox.runs >= self.max_runs:
+            await self._call(sandbox.destroy)
+            return
+        try:
+            await self._call(sandbox.reset)
+        except Exception as e:
+            logger.error(f"recycling sandbox {sandbox.container.short_id}: {e}")
+            await self._call(sandbox.destroy)
+            return
+        self._idle.append(sandbox)
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            now = time.monotonic()
+            by_recency = sorted(self._idle, key=lambda s: s.last_used, reverse=True)
+            # the warm containers are kept no matter how long they idle
+            stale = [sandbox for sandbox in by_recency[self.warm:] if now - sandbox.last_used >= self.idle_timeout]
+            # take them out of the pool before awaiting anything
+            self._idle = [sandbox for sandbox in self._idle if sandbox not in stale]
+            for sandbox in stale:
+                logger.info(f"reaping idle sandbox {sandbox.container.short_id}")
+                await self._call(sandbox.destroy)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        # let replacements being started land in _idle so they are removed too
+        await asyncio.gather(*self._spares, return_exceptions=True)
+        for sandbox in self._idle:
+            await self._call(sandbox.destroy)
+        self._idle = []
+        self._slots = None
+        self._started = None
+        if self.deps is not None:
+            self.deps.close()
+        self._executor.shutdown(wait=False)
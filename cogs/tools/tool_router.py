@@ -1,10 +1,20 @@
 
 import cogs.tools.get_current_temp as get_current_temp
 import cogs.tools.python_interpreter as py_inter
+from cogs.tools.result_cache import ResultCache
+from cogs.metrics import METRICS
+from cogs.log_setup import log_payload
+import copy
+import hashlib
+import importlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# shared by every tool with a "cache" entry, see configure()
+RESULT_CACHE = ResultCache()
+
 TOOL_LIST = {
     # get_current_tempurature
     "get_current_weather": {
@@ -25,6 +35,9 @@ TOOL_LIST = {
             }
         },
         "callable": get_current_temp.call_tool,
+        "configure": get_current_temp.configure,
+        "close": get_current_temp.close,
+        "stats": get_current_temp.stats,
     },
     "run_python_interpreter": {
         "type": "function",
@@ -49,28 +62,152 @@ TOOL_LIST = {
             }
         },
         "callable": py_inter.call_tool,
+        # identical programs without randomness, clocks or I/O print the same thing
+        "cache": {"ttl": 3600, "key": py_inter.cache_key, "cache_if": py_inter.cacheable_result},
+        "configure": py_inter.configure,
+        "close": py_inter.close,
     },
 }
 
+class ToolSet(list):
+    """Schemas of the tools offered to the model, serialized to JSON once"""
+
+    def __init__(self, schemas):
+        super().__init__(schemas)
+        self.json = json.dumps(schemas)
+        # the only tools a model offered this set may call
+        self.names = frozenset(schema["function"]["name"] for schema in schemas)
+
+NO_TOOLS = ToolSet([])
+
+# frozen OpenAI schema of every registered tool, built once by register_tool
+_SCHEMAS = {}
+# tuple of tool names -> ToolSet, so every payload offering the same tools shares one
+_TOOLSETS = {}
+# model name / channel id -> names of the tools allowed there; unlisted means all of them
+MODEL_TOOLS = {}
+CHANNEL_TOOLS = {}
+
+def _validate(name: str, spec: dict):
+    function = spec.get("function", {})
+    parameters = function.get("parameters", {})
+    if spec.get("type") != "function":
+        raise ValueError(f"tool {name}: only function tools are supported")
+    if not function.get("description"):
+        raise ValueError(f"tool {name}: missing description")
+    if parameters.get("type") != "object":
+        raise ValueError(f"tool {name}: parameters must be a JSON schema object")
+    missing = set(parameters.get("required", [])) - set(parameters.get("properties", {}))
+    if missing:
+        raise ValueError(f"tool {name}: required parameters {sorted(missing)} are not defined")
+    if not callable(spec.get("callable")):
+        raise ValueError(f"tool {name}: no callable")
+
+def register_tool(name: str, spec: dict):
+    """Add (or replace) a tool. spec has the shape of a TOOL_LIST entry"""
+    _validate(name, spec)
+    TOOL_LIST[name] = spec
+    # only the schema goes to the model, not the callable and lifecycle hooks
+    _SCHEMAS[name] = {"type": spec["type"], "function": {**copy.deepcopy(spec["function"]), "name": name}}
+    _TOOLSETS.clear()
+    logger.info(f"registered tool: {name}")
+
+def load_plugins(modules: list):
+    """Import plugin modules; each registers the tools in its TOOLS dict
+    (or calls register_tool itself on import)"""
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        for name, spec in getattr(module, "TOOLS", {}).items():
+            register_tool(name, spec)
+
+def tools_for(model: str = None, channel_id=None) -> ToolSet:
+    """The tools offered to model in channel_id. Empty when neither allows any"""
+    names = list(_SCHEMAS)
+    if model in MODEL_TOOLS:
+        names = [name for name in names if name in MODEL_TOOLS[model]]
+    if channel_id is not None and str(channel_id) in CHANNEL_TOOLS:
+        names = [name for name in names if name in CHANNEL_TOOLS[str(channel_id)]]
+    key = tuple(names)
+    if key not in _TOOLSETS:
+        _TOOLSETS[key] = ToolSet([_SCHEMAS[name] for name in names])
+    return _TOOLSETS[key]
+
 def open_ai_tool_list():
-    import copy
-    import json
+    return tools_for()
 
-    ret = []
+def encode_payload(payload: dict) -> bytes:
+    """JSON body of a chat request, splicing in the pre-serialized tool schemas"""
+    tools = payload.get("tools")
+    if not isinstance(tools, ToolSet):
+        return json.dumps(payload).encode()
+    body = json.dumps({k: v for k, v in payload.items() if k != "tools"})
+    return f'{body[:-1]}, "tools": {tools.json}}}'.encode()
+
+def configure(config: dict, cache_config: dict = None, registry_config: dict = None):
+    """Load plugin tools and the per-model/per-channel subsets from the 'tool_registry'
+    block, pass each tool its block of the 'tools' config, for tools with a configure
+    hook, and set up the result cache from the 'tool_cache' block"""
+    global RESULT_CACHE
+    registry_config = registry_config or {}
+    load_plugins(registry_config.get('plugins', []))
+    MODEL_TOOLS.clear()
+    MODEL_TOOLS.update({model: set(names) for model, names in registry_config.get('models', {}).items()})
+    CHANNEL_TOOLS.clear()
+    CHANNEL_TOOLS.update({str(channel): set(names) for channel, names in registry_config.get('channels', {}).items()})
+    _TOOLSETS.clear()
+    cache_config = cache_config or {}
+    RESULT_CACHE.close()
+    RESULT_CACHE = ResultCache(cache_config.get('max_entries', 512), cache_config.get('path'))
     for k, v in TOOL_LIST.items():
-        tool_desc = copy.deepcopy(v)
-        del tool_desc["callable"]
-        tool_desc["function"]["name"] = k
-        logger.info(f"importing tool: {k} with desc: {tool_desc}")
-        ret.append(tool_desc)
+        if "configure" in v and k in config:
+            v["configure"](config[k])
 
-    return ret
+async def close():
+    """Release whatever the tools hold on to (containers, clients)"""
+    for k, v in TOOL_LIST.items():
+        if "close" in v:
+            try:
+                await v["close"]()
+            except Exception as e:
+                logger.error(f"failed to close tool {k}: {e}")
+    RESULT_CACHE.close()
+
+def stats() -> dict:
+    """Counters of the tools that keep any, by tool name"""
+    stats = {k: v["stats"]() for k, v in TOOL_LIST.items() if "stats" in v}
+    stats["result_cache"] = RESULT_CACHE.stats()
+    return stats
 
 def get_all_tool_names():
     return list(TOOL_LIST.keys())
 
+def _cache_key(tool_name: str, cache: dict, kwargs: dict):
+    """Hash of the tool name and its key function's view of the arguments.
+    Without a key function every argument counts; a key of None means the call is not cached"""
+    key = cache["key"](**kwargs) if "key" in cache else kwargs
+    if key is None:
+        return None
+    return hashlib.sha256(json.dumps([tool_name, key], sort_keys=True).encode()).hexdigest()
+
 async def route_tool(tool_name:str, **kwargs) -> str:
-    logger.info(f"got arguments: {kwargs}")
-    return await TOOL_LIST[tool_name]["callable"](**kwargs)
+    log_payload(logger, f"{tool_name} arguments", kwargs)
+    with METRICS.span("tool_call", tool=tool_name):
+        return await _route_tool(tool_name, kwargs)
+
+async def _route_tool(tool_name: str, kwargs: dict):
+    tool = TOOL_LIST[tool_name]
+    cache = tool.get("cache")
+    key = _cache_key(tool_name, cache, kwargs) if cache is not None else None
+    if key is not None:
+        result = await RESULT_CACHE.get(key)
+        if result is not None:
+            logger.info(f"{tool_name} result served from cache")
+            return result
 
+    result = await tool["callable"](**kwargs)
+    if key is not None and cache.get("cache_if", lambda result: True)(result):
+        await RESULT_CACHE.put(key, result, cache["ttl"])
+    return result
 
+for _name, _spec in list(TOOL_LIST.items()):
+    register_tool(_name, _spec)
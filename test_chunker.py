@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Property tests for cogs.chunker over seeded random markdown documents"""
+
+import random
+import re
+
+from cogs.chunker import split_message
+
+WORDS = ["the", "model", "said", "token", "discord", "reply", "x", "supercalifragilistic", "42", "**bold**", "`code`"]
+LANGS = ["", "python", "js", "bash"]
+
+
+def random_words(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def random_block(rng):
+    kind = rng.choice(["paragraph", "list", "table", "code", "trailing", "long"])
+    if kind == "paragraph":
+        return "\n".join(random_words(rng, rng.randint(20, 300)) for _ in range(rng.randint(1, 4)))
+    if kind == "list":
+        return "\n".join(f"{rng.choice(['-', '*', '1.'])} {random_words(rng, rng.randint(5, 120))}"
+                         for _ in range(rng.randint(2, 8)))
+    if kind == "table":
+        rows = ["| a | b |", "|---|---|"]
+        rows += [f"| {random_words(rng, 10)} | {rng.randint(0, 10**6)} |" for _ in range(rng.randint(1, 15))]
+        return "\n".join(rows)
+    if kind == "code":
+        body = [f"    x_{n} = {random_words(rng, rng.randint(1, 40))!r}" for n in range(rng.randint(1, 40))]
+        return "\n".join([f"```{rng.choice(LANGS)}", *body, "```"])
+    if kind == "trailing":
+        # text after a closing fence, on the same line and longer than a chunk
+        return f"```{rng.choice(LANGS)}\n```{random_words(rng, rng.randint(500, 3000))}"
+    # a single line longer than any chunk, sometimes without spaces
+    if rng.random() < 0.3:
+        return "y" * rng.randint(500, 5000)
+    return random_words(rng, rng.randint(500, 5000))
+
+
+def random_document(rng):
+    blocks = [random_block(rng) for _ in range(rng.randint(1, 30))]
+    return rng.choice(["\n\n", "\n"]).join(blocks)
+
+
+def is_fence(line):
+    return line.lstrip().startswith("```")
+
+
+def code_lines(text):
+    """(language, line) for every line inside a code block"""
+    found = []
+    lang = None
+    for line in text.split("\n"):
+        if is_fence(line):
+            lang = line.strip()[3:] if lang is None else None
+        elif lang is not None:
+            found.append((lang, line))
+    return found
+
+
+def without_fences(text):
+    """text without whitespace and fence markers (backticks plus info string); text after those stays"""
+    return re.sub(r"\s", "", "".join(re.sub(r"^\s*```+\S*", "", line) for line in text.split("\n")))
+
+
+def check(text, limit):
+    chunks = split_message(text, limit)
+    for chunk in chunks:
+        assert len(chunk) <= limit, (len(chunk), limit)
+        assert chunk.strip()
+        assert sum(1 for line in chunk.split("\n") if is_fence(line)) % 2 == 0, chunk
+    # nothing lost or invented, only whitespace at split points
+    assert without_fences("\n".join(chunks)) == without_fences(text)
+    # every code line stays in a block with its original language
+    assert [line for chunk in chunks for line in code_lines(chunk)] == code_lines(text)
+    return chunks
+
+
+def test_random_documents():
+    rng = random.Random(1234)
+    for _ in range(300):
+        check(random_document(rng), rng.choice([100, 300, 2000]))
+
+
+def test_round_trip_without_code_or_long_lines():
+    rng = random.Random(99)
+    for _ in range(300):
+        blocks = []
+        for _ in range(rng.randint(1, 30)):
+            block = random_block(rng)
+            if "```" not in block and max(len(line) for line in block.split("\n")) < 250:
+                blocks.append(block)
+        text = "\n\n".join(blocks)
+        if not text:
+            continue
+        assert "\n".join(check(text, 300)) == text
+
+
+def test_list_items_and_table_rows_are_not_split():
+    rng = random.Random(7)
+    text = "\n\n".join(random_block(rng) for _ in range(200))
+    chunk_lines = {line for chunk in split_message(text) for line in chunk.split("\n")}
+    for line in text.split("\n"):
+        if len(line) < 500 and (line.startswith("|") or re.match(r"[-*]|1\.", line)):
+            assert line in chunk_lines
+
+
+def test_reopened_fence_keeps_language():
+    text = "```python\n" + "\n".join(f"print({n})" for n in range(500)) + "\n```"
+    chunks = split_message(text)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("```python\n") and chunk.endswith("\n```") for chunk in chunks)
+
+
+def test_no_empty_block_before_long_line():
+    for intro in ("", "intro\n", "a" * 1990 + "\n"):
+        chunks = split_message(intro + "```python\n" + "y" * 3000 + "\n```")
+        assert all(len(chunk) <= 2000 for chunk in chunks)
+        assert not any(re.fullmatch(r"(?s)(.*\n)?```\w*\n```", chunk) for chunk in chunks), chunks
+        assert all(chunk.startswith("```python\n") for chunk in chunks if "y" in chunk)
+
+
+def test_short_text_is_untouched():
+    assert split_message("hello") == ["hello"]
+
+
+if __name__ == "__main__":
+    test_random_documents()
+    test_round_trip_without_code_or_long_lines()
+    test_list_items_and_table_rows_are_not_split()
+    test_reopened_fence_keeps_language()
+    test_no_empty_block_before_long_line()
+    test_short_text_is_untouched()
+    print("✓ chunker properties hold")
@@ -3,6 +3,7 @@
 
 import sys
 import os
+import asyncio
 
 # Add parent directory to path to import discord
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -27,12 +28,11 @@ try:
     from cogs.chat_cog import ChatCog
 
     # Add cogs using the same pattern as bot.py
-    def add_cog(bot, cog):
-        try:
-            bot.add_cog(cog).send(None)
-        except StopIteration as e:
-            logger.info(f'Successfully loaded {cog.__class__.__name__}')
-            logger.info(f'Commands in {cog.__class__.__name__}: {[command.name for command in cog.get_commands()]}')
+    async def add_cog(bot, cog):
+        # cog_load needs a running loop (ChatCog opens its HTTP session there)
+        await bot.add_cog(cog)
+        logger.info(f'Successfully loaded {cog.__class__.__name__}')
+        logger.info(f'Commands in {cog.__class__.__name__}: {[command.name for command in cog.get_commands()]}')
     
     import logging
     logging.basicConfig(level=logging.INFO)
@@ -42,25 +42,33 @@ try:
     print("LOADING COGS...")
     print("=" * 50 + "\n")
 
-    print("Adding HelloCog...")
-    add_cog(bot, HelloCog(bot))
+    async def main():
+        # one loop for loading, listing and unloading, so cog_unload can close
+        # what cog_load opened (the HTTP session, the backend probe task)
+        print("Adding HelloCog...")
+        await add_cog(bot, HelloCog(bot))
 
-    print("Adding ChatCog...")
-    add_cog(bot, ChatCog(bot))
+        print("Adding ChatCog...")
+        await add_cog(bot, ChatCog(bot))
 
-    print("\n" + "=" * 50)
-    print("ALL REGISTERED COMMANDS:")
-    print("=" * 50)
-    for command in bot.commands:
-        print(f"  - {command.name}")
-    print("=" * 50 + "\n")
+        print("\n" + "=" * 50)
+        print("ALL REGISTERED COMMANDS:")
+        print("=" * 50)
+        for command in bot.commands:
+            print(f"  - {command.name}")
+        print("=" * 50 + "\n")
 
-    print("\n" + "=" * 50)
-    print("ALL COMMANDS (via all_commands):")
-    print("=" * 50)
-    for name, command in bot.all_commands.items():
-        print(f"  - {name} (cog: {command.cog_name})")
-    print("=" * 50 + "\n")
+        print("\n" + "=" * 50)
+        print("ALL COMMANDS (via all_commands):")
+        print("=" * 50)
+        for name, command in bot.all_commands.items():
+            print(f"  - {name} (cog: {command.cog_name})")
+        print("=" * 50 + "\n")
+
+        for name in list(bot.cogs):
+            await bot.remove_cog(name)
+
+    asyncio.run(main())
 
 except Exception as e:
     print(f"Error: {e}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Tests for the retries and circuit breakers of cogs.llm_router.BackendRouter"""
+
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cogs.llm_router import Backend, BackendRouter, BackendUnavailable, CircuitBreaker, RetryPolicy
+
+
+async def with_stub(statuses, check):
+    """Serve POST /v1/chat/completions answering each status of statuses in
+    turn, then 200, and run check(router, session, stub_hits) against it"""
+    hits = []
+
+    async def completions(request):
+        status = statuses[len(hits)] if len(hits) < len(statuses) else 200
+        hits.append(status)
+        return web.Response(status=status, headers={"Retry-After": "0"} if status != 200 else {})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    async with TestServer(app) as server:
+        router = BackendRouter([Backend(str(server.make_url("/")))], retry=RetryPolicy(backoff_base=0.01))
+        async with aiohttp.ClientSession() as session:
+            await check(router, session, hits)
+
+
+def test_busy_backend_is_retried_without_opening_the_circuit():
+    async def check(router, session, hits):
+        backend, response = await router.post(session, "m", "/chat/completions", b"{}", {}, 10)
+        response.release()
+        router.release(backend)
+        assert response.status == 200
+        assert hits == [503, 503, 503, 200], hits
+        assert backend.breaker.state == "closed"
+
+    asyncio.run(with_stub([503, 503, 503], check))
+
+
+def test_retried_status_is_returned_after_the_last_attempt():
+    async def check(router, session, hits):
+        backend, response = await router.post(session, "m", "/chat/completions", b"{}", {}, 10)
+        response.release()
+        assert response.status == 429
+        assert len(hits) == router.retry.max_attempts
+        assert backend.breaker.state == "closed"
+        router.release(backend)
+
+    asyncio.run(with_stub([429] * 10, check))
+
+
+def test_unreachable_backend_opens_the_circuit():
+    async def run():
+        router = BackendRouter([Backend("http://127.0.0.1:9")], retry=RetryPolicy(max_attempts=2, backoff_base=0.01))
+        async with aiohttp.ClientSession() as session:
+            try:
+                await router.post(session, "m", "/chat/completions", b"{}", {}, 10)
+            except aiohttp.ClientConnectionError as e:
+                assert not isinstance(e, BackendUnavailable)
+            else:
+                raise AssertionError("post to a closed port succeeded")
+            assert router.backends[0].breaker.state == "open"
+            try:
+                await router.post(session, "m", "/chat/completions", b"{}", {}, 10)
+            except BackendUnavailable:
+                pass
+            else:
+                raise AssertionError("open circuit did not fail fast")
+
+    asyncio.run(run())
+
+
+def test_breaker_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.try_trial()
+    assert not breaker.try_trial()
+    assert breaker.record_timeout()
+    assert breaker.state == "open"
+    assert breaker.try_trial()
+    assert breaker.record_success()
+    assert breaker.state == "closed"
+
+
+if __name__ == "__main__":
+    test_busy_backend_is_retried_without_opening_the_circuit()
+    test_retried_status_is_returned_after_the_last_attempt()
+    test_unreachable_backend_opens_the_circuit()
+    test_breaker_half_open_trial()
+    print("✓ router retries and breakers behave")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Tests for the fair queueing of cogs.scheduler.RequestScheduler"""
+
+import asyncio
+
+from cogs.scheduler import RequestScheduler
+
+
+async def serve_order(scheduler, submissions):
+    """Submit (key, user, channel) requests in order, holding the slots until
+    all of them are queued, and return the keys in the order they started"""
+    started = []
+    all_queued = asyncio.Event()
+
+    async def request(key, user_id, channel_id):
+        async with scheduler.slot(key, user_id, channel_id):
+            started.append(key)
+            await all_queued.wait()
+
+    tasks = []
+    for submission in submissions:
+        tasks.append(asyncio.create_task(request(*submission)))
+        # let the request reach the queue before the next one arrives
+        await asyncio.sleep(0)
+    all_queued.set()
+    await asyncio.gather(*tasks)
+    return started
+
+
+def test_round_robin_survives_an_empty_queue():
+    scheduler = RequestScheduler(max_concurrent=1, per_user=1, per_channel=1)
+    submissions = [("a1", "a", 1), ("a2", "a", 1), ("a3", "a", 1), ("b1", "b", 1), ("c1", "c", 1)]
+    order = asyncio.run(serve_order(scheduler, submissions))
+    assert order == ["a1", "b1", "c1", "a2", "a3"], order
+
+
+def test_per_user_limit():
+    scheduler = RequestScheduler(max_concurrent=4, per_user=1, per_channel=4)
+
+    async def run():
+        running = []
+        peak = 0
+
+        async def request(key):
+            nonlocal peak
+            async with scheduler.slot(key, "a", 1):
+                running.append(key)
+                peak = max(peak, len(running))
+                await asyncio.sleep(0)
+                running.remove(key)
+
+        await asyncio.gather(*(request(n) for n in range(5)))
+        return peak
+
+    assert asyncio.run(run()) == 1
+
+
+def test_cancel_waiting_request():
+    scheduler = RequestScheduler(max_concurrent=1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("first", "a", 1):
+                await release.wait()
+
+        async def waiter():
+            async with scheduler.slot("second", "b", 1):
+                pass
+
+        first = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+        assert scheduler.cancel("second")
+        release.set()
+        await first
+        return await asyncio.gather(second, return_exceptions=True)
+
+    result = asyncio.run(run())
+    assert type(result[0]).__name__ == "RequestCancelled"
+
+
+if __name__ == "__main__":
+    test_round_robin_survives_an_empty_queue()
+    test_per_user_limit()
+    test_cancel_waiting_request()
+    print("scheduler tests passed")